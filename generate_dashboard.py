@@ -1,9 +1,222 @@
 import requests
 import pandas as pd
+import numpy as np
 import os
 import json # Import json for embedding data
 import re # Import regex module for cleaning
 import traceback # Import traceback for detailed error logging
+import sys
+import hashlib # Import hashlib for content-hashed asset filenames
+import base64 # Import base64 for inlining the blurred placeholder
+import io
+import platform # Import platform to pick the matching Tailwind CLI binary
+import stat
+import subprocess # Import subprocess to run the Tailwind CLI
+import tempfile
+import importlib.util # Import importlib.util to detect the optional Parquet/Excel writers
+import unicodedata # Import unicodedata for ASCII export filenames
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor # Import ThreadPoolExecutor to write export files concurrently
+from html import escape
+from PIL import Image, ImageFilter, ImageOps, features
+
+# --- Asset pipeline settings ---
+BACKGROUND_IMAGE = 'assets/AY1A8030.jpg' # Full-resolution camera JPEG used as the page background
+ASSET_BUILD_DIR = 'assets/build' # Resized/re-encoded variants are written here
+ASSET_CACHE_FILE = os.path.join(ASSET_BUILD_DIR, 'asset-cache.json')
+BACKGROUND_WIDTHS = [640, 1280, 1920, 2560] # Responsive widths (px) for the background variants
+BACKGROUND_DPRS = [1, 1.5, 2, 3] # Device pixel ratio tiers the variant media queries distinguish
+# Output formats in order of preference; JPEG is always produced as the fallback
+BACKGROUND_FORMATS = [
+    ('avif', 'AVIF', 'image/avif', {'quality': 50}),
+    ('webp', 'WEBP', 'image/webp', {'quality': 72, 'method': 6}),
+    ('jpg', 'JPEG', 'image/jpeg', {'quality': 78, 'optimize': True, 'progressive': True}),
+]
+PLACEHOLDER_WIDTH = 24 # Width (px) of the tiny blurred placeholder inlined into the HTML
+
+# --- Front-end dependency settings ---
+VENDOR_DIR = 'assets/vendor' # Pinned third-party scripts are downloaded here once and committed
+# Pinned versions so the vendored copies (and the bundle hashes) only change on purpose.
+# name -> (URL, sha256 of the file). A file that does not match its sha256, or has none pinned, is
+# refused and the page falls back to the CDN. Get the values with: python generate_dashboard.py --print-pins
+VENDOR_SCRIPTS = {
+    'chart.umd.js': ('https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.js', None),
+    'chartjs-plugin-datalabels.min.js': ('https://cdn.jsdelivr.net/npm/chartjs-plugin-datalabels@2.0.0/dist/chartjs-plugin-datalabels.min.js', None),
+    'html2canvas.min.js': ('https://cdnjs.cloudflare.com/ajax/libs/html2canvas/1.4.1/html2canvas.min.js', None),
+    'jspdf.umd.min.js': ('https://cdnjs.cloudflare.com/ajax/libs/jspdf/2.5.1/jspdf.umd.min.js', None),
+}
+# Scripts needed for the charts (deferred on every page view) vs. only for the PDF export (loaded on click)
+CHART_BUNDLE = ['chart.umd.js', 'chartjs-plugin-datalabels.min.js']
+PDF_BUNDLE = ['html2canvas.min.js', 'jspdf.umd.min.js']
+TAILWIND_VERSION = 'v3.4.17' # Same major version as the Play CDN the page used before
+TAILWIND_CACHE_DIR = '.cache/tailwindcss' # Downloaded CLI binary (not committed)
+# sha256 of each release binary of TAILWIND_VERSION; the binary is only executed when it matches
+TAILWIND_SHA256 = {
+    'tailwindcss-linux-x64': None,
+    'tailwindcss-linux-arm64': None,
+    'tailwindcss-macos-x64': None,
+    'tailwindcss-macos-arm64': None,
+    'tailwindcss-windows-x64.exe': None,
+}
+
+# --- Output settings ---
+OUTPUT_HTML = 'index.html'
+BUILD_MANIFEST = 'build-manifest.json' # Every generated artifact with its sha256 and size
+generated_artifacts = {} # Filled in by write_output_file(), written out as the build manifest at the end
+
+# --- Offline/delta update settings ---
+DATA_DIR = 'data' # Versioned data snapshot and delta patches for returning visitors
+DATA_SNAPSHOT = os.path.join(DATA_DIR, 'dashboard-data.json') # Full dashboard_data of the latest build
+DATA_VERSION_FILE = os.path.join(DATA_DIR, 'version.json') # Latest version plus the recent version history
+DATA_PATCH_DIR = os.path.join(DATA_DIR, 'patches') # <from>-<to>.json patches between consecutive versions
+DATA_HISTORY_LENGTH = 30 # Number of past versions a returning visitor can catch up from with patches
+SERVICE_WORKER = 'sw.js'
+SERVICE_WORKER_CACHE = 'lmsm-dashboard-v1' # Bump to drop every cached response on the next visit
+
+# --- Detailed table settings ---
+# Columns of detailedTableData that the table worker dictionary-codes (search, filters, sorting)
+DETAILED_TABLE_COLUMNS = ['Munisipiu', 'Seksu', 'Idade', 'Dixiplina', 'Nivel Eskola', 'Naran Eskola', 'Titulu/Tópiku', 'Timestamp']
+
+# Web Worker that owns the detailed table: it parses the embedded rows (sent as JSON text, so the page
+# never parses or codes them), applies delta patches, dictionary-codes the columns and answers each
+# query with the rows of the visible page only. Embedded in the page and started from a Blob, so it
+# also works from file://.
+TABLE_WORKER_JS = """
+let tableRows = [];
+let columns = [];
+let dictionaries = [];
+let lowerDictionaries = [];
+let ranks = [];
+let codes = new Uint32Array(0); // Column-major: codes[column * rowCount + row]
+let rowCount = 0;
+let cachedKey = null;
+let cachedRows = null;
+
+// Dictionary-code the rows: per column the distinct values plus one code per row
+function setRows(rows) {
+    tableRows = rows;
+    rowCount = rows.length;
+    codes = new Uint32Array(columns.length * rowCount);
+    dictionaries = columns.map((column, columnIndex) => {
+        const lookup = new Map();
+        const offset = columnIndex * rowCount;
+        rows.forEach((row, rowIndex) => {
+            const value = String(row[column] !== undefined && row[column] !== null ? row[column] : 'N/A');
+            let code = lookup.get(value);
+            if (code === undefined) {
+                code = lookup.size;
+                lookup.set(value, code);
+            }
+            codes[offset + rowIndex] = code;
+        });
+        return Array.from(lookup.keys());
+    });
+    lowerDictionaries = dictionaries.map(values => values.map(value => String(value).toLowerCase()));
+    // Sort rank of every dictionary entry, so sorting compares integers instead of strings
+    ranks = dictionaries.map(values => {
+        const order = values.map((_, code) => code).sort((a, b) => String(values[a]).localeCompare(String(values[b]), undefined, { numeric: true }));
+        const rank = new Uint32Array(values.length);
+        order.forEach((code, position) => { rank[code] = position; });
+        return rank;
+    });
+    cachedKey = null;
+    cachedRows = null;
+}
+
+// Apply a delta patch (rows matched by id) and keep the sheet order
+function applyPatch(patch) {
+    const rows = new Map(tableRows.map(row => [row.id, row]));
+    patch.removed.forEach(id => rows.delete(id));
+    patch.upserts.forEach(row => rows.set(row.id, row));
+    setRows(Array.from(rows.values()).sort((a, b) => Number(a.id) - Number(b.id)));
+}
+
+// Filtered and sorted row indices; cached so paging through the same result does no work
+function matchingRows(query) {
+    const key = JSON.stringify([query.search, query.filters, query.sort]);
+    if (key === cachedKey) {
+        return cachedRows;
+    }
+
+    // The search term is matched against each distinct value once, not against every cell
+    const term = query.search.toLowerCase();
+    const searchMatches = term === '' ? null : lowerDictionaries.map(values => Uint8Array.from(values, value => value.includes(term) ? 1 : 0));
+    const filterCodes = Object.entries(query.filters)
+        .filter(([, value]) => value !== 'All')
+        .map(([column, value]) => [columns.indexOf(column), dictionaries[columns.indexOf(column)].indexOf(value)]);
+
+    const rows = [];
+    for (let row = 0; row < rowCount; row++) {
+        let keep = filterCodes.every(([column, code]) => codes[column * rowCount + row] === code);
+        if (keep && searchMatches) {
+            keep = false;
+            for (let column = 0; column < columns.length; column++) {
+                if (searchMatches[column][codes[column * rowCount + row]]) {
+                    keep = true;
+                    break;
+                }
+            }
+        }
+        if (keep) {
+            rows.push(row);
+        }
+    }
+
+    if (query.sort && columns.includes(query.sort.column)) {
+        const column = columns.indexOf(query.sort.column);
+        const rank = ranks[column];
+        const direction = query.sort.direction === 'desc' ? -1 : 1;
+        rows.sort((a, b) => (rank[codes[column * rowCount + a]] - rank[codes[column * rowCount + b]]) * direction || a - b);
+    }
+
+    cachedKey = key;
+    cachedRows = rows;
+    return rows;
+}
+
+function runQuery(query) {
+    const rows = matchingRows(query);
+    const rowsPerPage = query.rowsPerPage === 'All' ? Math.max(rows.length, 1) : query.rowsPerPage;
+    const totalPages = Math.max(1, Math.ceil(rows.length / rowsPerPage));
+    const page = Math.min(Math.max(query.page, 1), totalPages);
+    const pageRows = rows.slice((page - 1) * rowsPerPage, page * rowsPerPage).map(row => tableRows[row]);
+    self.postMessage({ type: 'page', requestId: query.requestId, rows: pageRows, page, totalPages, totalRows: rows.length });
+}
+
+self.onmessage = (event) => {
+    const message = event.data;
+    if (message.type === 'load') {
+        columns = message.columns;
+        setRows(JSON.parse(message.json));
+    } else if (message.type === 'rows') {
+        setRows(message.rows);
+    } else if (message.type === 'patch') {
+        applyPatch(message);
+    } else if (message.type === 'query') {
+        runQuery(message);
+    }
+};
+"""
+
+# --- Export settings ---
+EXPORT_DIR = 'exports' # Downloadable per-municipality and per-school-level files
+EXPORT_MANIFEST = os.path.join(EXPORT_DIR, 'export-manifest.json') # Content hash of every partition from the last build
+EXPORT_WORKBOOK = os.path.join(EXPORT_DIR, 'lmsm-2025-dadus.xlsx') # All rows plus one sheet per municipality
+# Partition kind (sub-directory of EXPORT_DIR) -> detailedTableData column it is split on
+EXPORT_PARTITIONS = {'munisipiu': 'Munisipiu', 'nivel-eskola': 'Nivel Eskola'}
+EXPORT_MAX_WORKERS = min(8, os.cpu_count() or 1)
+HAS_PARQUET = importlib.util.find_spec('pyarrow') is not None # Optional: Parquet files are skipped without pyarrow
+HAS_EXCEL = importlib.util.find_spec('openpyxl') is not None # Optional: the workbook is skipped without openpyxl
+
+# --- Chart settings ---
+CHART_COLORS = [
+    'rgba(75, 192, 192, 0.6)', 'rgba(153, 102, 255, 0.6)', 'rgba(255, 159, 64, 0.6)',
+    'rgba(255, 99, 132, 0.6)', 'rgba(54, 162, 235, 0.6)', 'rgba(201, 203, 207, 0.6)',
+    'rgba(255, 205, 86, 0.6)', 'rgba(100, 149, 237, 0.6)', 'rgba(255, 0, 255, 0.6)',
+    'rgba(0, 255, 0, 0.6)', 'rgba(0, 0, 255, 0.6)', 'rgba(128, 0, 128, 0.6)'
+]
+CHART_TOP_N = 15 # Categorical charts with more labels than this keep the top N-1 and bucket the rest
+OTHER_LABEL = 'Seluk' # Label for the bucket of remaining categories
 
 # Helper function to clean a single header string
 def clean_header_string(header):
@@ -15,275 +228,1008 @@ def clean_header_string(header):
     cleaned = cleaned.replace('*', '').strip()
     return cleaned
 
+# Helper function to hash bytes for content-addressed filenames and cache keys
+def content_hash(data, length=10):
+    return hashlib.sha256(data).hexdigest()[:length]
+
+# Helper function to write a generated file atomically (temp file + rename), so a crash never leaves
+# a truncated file behind. Identical content is not rewritten. Returns True if the file changed.
+def write_output_file(path, data, record=True):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    if record:
+        generated_artifacts[path.replace(os.sep, '/')] = {"sha256": digest, "size": len(data)}
+
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if hashlib.sha256(f.read()).hexdigest() == digest:
+                    return False
+    except OSError:
+        pass # Missing file: write it
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644) # mkstemp creates files as 0600
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+# Helper function to add an existing generated file (e.g. a cached variant) to the build manifest
+def record_artifact(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    generated_artifacts[path.replace(os.sep, '/')] = {"sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+
+# Helper function to load the processed-asset cache (source hash -> generated variants)
+def load_asset_cache():
+    try:
+        with open(ASSET_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# Helper function to save the processed-asset cache
+def save_asset_cache(cache):
+    write_output_file(ASSET_CACHE_FILE, json.dumps(cache, indent=2, sort_keys=True))
+
+# Helper function to resize and re-encode the background image into responsive variants.
+# Returns {"variants": {width: [(filename, mime), ...]}, "placeholder": data_uri} or None if the
+# source image is missing. Outputs are cached by source hash, so an unchanged image is not reprocessed.
+def process_background_image(src_path):
+    if not os.path.exists(src_path):
+        print(f"--- WARNING: background image '{src_path}' not found, skipping asset pipeline. ---")
+        return None
+
+    with open(src_path, 'rb') as f:
+        src_bytes = f.read()
+
+    # The cache key covers the source bytes and the pipeline settings, so changing
+    # widths or quality also invalidates previously generated variants
+    settings_signature = json.dumps([BACKGROUND_WIDTHS, [fmt[:2] + (fmt[3],) for fmt in BACKGROUND_FORMATS], PLACEHOLDER_WIDTH], sort_keys=True)
+    cache_key = content_hash(src_bytes + settings_signature.encode('utf-8'), length=16)
+
+    cache = load_asset_cache()
+    cached = cache.get(cache_key)
+    if cached and "aspect" in cached and all(os.path.exists(os.path.join(ASSET_BUILD_DIR, name)) for files in cached['variants'].values() for name, _ in files):
+        print(f"Background image unchanged ({cache_key}), reusing cached variants.")
+        for files in cached['variants'].values():
+            for name, _ in files:
+                record_artifact(os.path.join(ASSET_BUILD_DIR, name))
+        record_artifact(ASSET_CACHE_FILE)
+        return cached
+
+    print(f"Processing background image '{src_path}'...")
+    os.makedirs(ASSET_BUILD_DIR, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(src_bytes))).convert('RGB')
+    result = {"variants": {}, "placeholder": "", "aspect": image.width / image.height}
+
+    for width in BACKGROUND_WIDTHS:
+        # Never upscale: widths larger than the source reuse the source width
+        target_width = min(width, image.width)
+        target_height = round(image.height * target_width / image.width)
+        resized = image.resize((target_width, target_height), Image.LANCZOS)
+
+        files = []
+        for ext, pil_format, mime, save_options in BACKGROUND_FORMATS:
+            if pil_format != 'JPEG' and not features.check(pil_format.lower()):
+                print(f"--- WARNING: Pillow was built without {pil_format} support, skipping {ext} variants. ---")
+                continue
+            buffer = io.BytesIO()
+            resized.save(buffer, pil_format, **save_options)
+            encoded = buffer.getvalue()
+            filename = f"{stem}-{width}.{content_hash(encoded)}.{ext}"
+            write_output_file(os.path.join(ASSET_BUILD_DIR, filename), encoded)
+            files.append((filename, mime))
+            print(f"  {filename}: {len(encoded) / 1024:.1f} KiB")
+        result["variants"][str(width)] = files
+
+    # Tiny blurred placeholder, inlined as a data URI so it paints with the first HTML byte
+    placeholder_height = max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))
+    placeholder = image.resize((PLACEHOLDER_WIDTH, placeholder_height), Image.LANCZOS).filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    placeholder.save(buffer, 'JPEG', quality=40, optimize=True)
+    result["placeholder"] = "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    # Remove variants left over from a previous version of the photo
+    current_files = {name for files in result["variants"].values() for name, _ in files}
+    for name in os.listdir(ASSET_BUILD_DIR):
+        if name.startswith(f"{stem}-") and name not in current_files:
+            os.remove(os.path.join(ASSET_BUILD_DIR, name))
+
+    # Only keep the current entry so the cache does not grow with every photo change
+    save_asset_cache({cache_key: result})
+    return result
+
+# Helper function to build the media query that switches to the next background variant once the previous
+# one (prev_width px wide) would be upscaled. With background-size: cover the image is drawn
+# max(viewport width, viewport height * aspect) CSS px wide, times the device pixel ratio, so a
+# portrait phone is limited by its height and a DPR 3 screen needs three times the pixels.
+def background_media_query(prev_width, aspect):
+    queries = []
+    for dpr in BACKGROUND_DPRS:
+        # -webkit-min-device-pixel-ratio for Safari before 16, which lacks the dppx unit
+        resolutions = [f"(min-resolution: {dpr}dppx) and ", f"(-webkit-min-device-pixel-ratio: {dpr}) and "] if dpr > 1 else [""]
+        for resolution in resolutions:
+            queries.append(f"{resolution}(min-width: {int(prev_width / dpr) + 1}px)")
+            queries.append(f"{resolution}(min-height: {int(prev_width / (dpr * aspect)) + 1}px)")
+    return "@media " + ", ".join(queries)
+
+# Helper function to build the background CSS from the processed variants.
+# The blurred placeholder sits on <html> underneath the body, so it shows until the variant loads.
+def build_background_css(assets):
+    if not assets:
+        # Fall back to the original full-size image when the pipeline could not run
+        return f"""body {{
+            background-image: url('./{BACKGROUND_IMAGE}');
+        }}"""
+
+    rules = [f"""html {{
+            background-image: url('{assets['placeholder']}');
+            background-size: cover;
+            background-position: center center;
+            background-attachment: fixed;
+        }}"""]
+    widths = sorted(assets["variants"], key=int)
+    for i, width in enumerate(widths):
+        files = [(f"./{ASSET_BUILD_DIR}/{name}", mime) for name, mime in assets["variants"][width]]
+        image_set = ", ".join(f"url('{url}') type('{mime}')" for url, mime in files)
+        # The plain url() line is the fallback for browsers without image-set() type() support (JPEG is always last)
+        declarations = f"""body {{
+            background-image: url('{files[-1][0]}');
+            background-image: image-set({image_set});
+        }}"""
+        if i == 0:
+            rules.append(declarations)
+        else:
+            # Later rules win, so the largest variant whose predecessor would be upscaled is used
+            rules.append(f"{background_media_query(int(widths[i - 1]), assets['aspect'])} {{\n        {declarations}\n        }}")
+    return "\n        ".join(rules)
+
+# Helper function to write a content-hashed build file (e.g. charts.<hash>.js) and remove
+# older versions with the same prefix. Returns the URL to reference from index.html.
+def write_hashed_asset(prefix, ext, data):
+    os.makedirs(ASSET_BUILD_DIR, exist_ok=True)
+    filename = f"{prefix}.{content_hash(data)}.{ext}"
+    for name in os.listdir(ASSET_BUILD_DIR):
+        if name.startswith(f"{prefix}.") and name.endswith(f".{ext}") and name != filename:
+            os.remove(os.path.join(ASSET_BUILD_DIR, name))
+    write_output_file(os.path.join(ASSET_BUILD_DIR, filename), data)
+    print(f"  {filename}: {len(data) / 1024:.1f} KiB")
+    return f"./{ASSET_BUILD_DIR}/{filename}"
+
+# Helper function to refuse a downloaded file whose sha256 is not the pinned one
+def verify_pinned_sha256(data, expected_sha256, source):
+    if not expected_sha256:
+        raise ValueError(f"no sha256 pinned for {source} (see --print-pins)")
+    actual = hashlib.sha256(data).hexdigest()
+    if actual != expected_sha256:
+        raise ValueError(f"sha256 mismatch for {source}: expected {expected_sha256}, got {actual}")
+
+# Helper function to return a vendored script, downloading the pinned version the first time
+def fetch_vendor_script(name):
+    url, expected_sha256 = VENDOR_SCRIPTS[name]
+    path = os.path.join(VENDOR_DIR, name)
+    if not os.path.exists(path):
+        print(f"Downloading {url}...")
+        response = requests.get(url, timeout=60)
+        response.raise_for_status()
+        verify_pinned_sha256(response.content, expected_sha256, url)
+        write_output_file(path, response.content, record=False) # Downloaded input, not a build artifact
+    with open(path, 'rb') as f:
+        data = f.read()
+    verify_pinned_sha256(data, expected_sha256, path) # Also catches a modified committed copy
+    return data
+
+# Helper function to concatenate vendored scripts into one content-hashed bundle.
+# Returns the bundle URL, or None if a script could not be fetched (the page then falls back to the CDN).
+def build_vendor_bundle(prefix, names):
+    try:
+        parts = [fetch_vendor_script(name) for name in names]
+    except Exception as e:
+        print(f"--- WARNING: could not vendor {names}, falling back to CDN scripts: {e} ---")
+        return None
+    # UMD builds attach to window, so plain concatenation keeps their load order
+    return write_hashed_asset(prefix, 'js', b';\n'.join(part.strip() for part in parts) + b';\n')
+
+# Helper function to return the Tailwind standalone CLI for this platform, downloading it the first time
+def ensure_tailwind_cli():
+    system = {'Linux': 'linux', 'Darwin': 'macos', 'Windows': 'windows'}[platform.system()]
+    arch = 'arm64' if platform.machine().lower() in ('arm64', 'aarch64') else 'x64'
+    binary_name = f"tailwindcss-{system}-{arch}" + ('.exe' if system == 'windows' else '')
+    expected_sha256 = TAILWIND_SHA256.get(binary_name)
+    path = os.path.join(TAILWIND_CACHE_DIR, TAILWIND_VERSION, binary_name)
+    if not os.path.exists(path):
+        url = tailwind_cli_url(binary_name)
+        print(f"Downloading {url}...")
+        response = requests.get(url, timeout=120)
+        response.raise_for_status()
+        verify_pinned_sha256(response.content, expected_sha256, url)
+        write_output_file(path, response.content, record=False)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    # Checked before every run, as the cached binary is restored from the CI cache
+    with open(path, 'rb') as f:
+        verify_pinned_sha256(f.read(), expected_sha256, path)
+    return path
+
+# Helper function to build the release URL of a Tailwind CLI binary
+def tailwind_cli_url(binary_name):
+    return f"https://github.com/tailwindlabs/tailwindcss/releases/download/{TAILWIND_VERSION}/{binary_name}"
+
+# Helper function to download every pinned file and print its sha256, for filling in VENDOR_SCRIPTS and
+# TAILWIND_SHA256 after a version bump. Review the downloaded versions before pasting the values.
+def print_pins():
+    urls = [url for url, _ in VENDOR_SCRIPTS.values()] + [tailwind_cli_url(name) for name in TAILWIND_SHA256]
+    for url in urls:
+        response = requests.get(url, timeout=120)
+        response.raise_for_status()
+        print(f"{hashlib.sha256(response.content).hexdigest()}  {url}")
+
+# Helper function to compile a minified Tailwind stylesheet containing only the classes used in the page.
+# Returns the stylesheet URL, or None if the CLI is unavailable (the page then falls back to the Play CDN).
+def build_tailwind_css(html):
+    try:
+        binary = ensure_tailwind_cli()
+        with tempfile.TemporaryDirectory() as tmp:
+            content_path = os.path.join(tmp, 'index.html')
+            input_path = os.path.join(tmp, 'input.css')
+            output_path = os.path.join(tmp, 'output.css')
+            with open(content_path, 'w', encoding='utf-8') as f:
+                f.write(html)
+            with open(input_path, 'w', encoding='utf-8') as f:
+                f.write("@tailwind base;\n@tailwind components;\n@tailwind utilities;\n")
+            # --content makes Tailwind purge every utility that does not appear in the generated page
+            subprocess.run([binary, '-i', input_path, '-o', output_path, '--content', content_path, '--minify'],
+                           check=True, capture_output=True, timeout=300)
+            with open(output_path, 'rb') as f:
+                css = f.read()
+    except Exception as e:
+        print(f"--- WARNING: could not build Tailwind CSS, falling back to the Play CDN: {e} ---")
+        return None
+    return write_hashed_asset('tailwind', 'css', css)
+
+# Helper function to turn {"labels", "data"} into a chart-ready payload, so the page does not
+# have to compute colors or percentages. Long categorical lists are sorted and cut to top_n.
+def prepare_chart_payload(chart_data, top_n=None):
+    labels = list(chart_data.get("labels", []))
+    data = [int(value) for value in chart_data.get("data", [])]
+
+    if top_n and len(labels) > top_n:
+        ranked = sorted(zip(labels, data), key=lambda item: item[1], reverse=True)
+        kept, rest = ranked[:top_n - 1], ranked[top_n - 1:]
+        labels = [label for label, _ in kept] + [OTHER_LABEL]
+        data = [value for _, value in kept] + [sum(value for _, value in rest)]
+
+    total = sum(data)
+    colors = [CHART_COLORS[i % len(CHART_COLORS)] for i in range(len(labels))]
+    return {
+        "labels": labels,
+        "data": data,
+        "percentages": [f"{value * 100 / total:.1f}%" for value in data] if total > 0 else [],
+        "backgroundColor": colors,
+        "borderColor": [color.replace('0.6', '1') for color in colors],
+    }
+
+# Helper function to load a JSON file written by a previous build (None if missing or invalid)
+def load_json_file(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Helper function to version dashboard_data and write the snapshot plus a delta patch from the previous build.
+# A patch holds the detailed rows added/changed (by id), the removed ids and all updated aggregates,
+# so a returning visitor only downloads the difference. Sets dashboard_data["version"].
+def write_data_versions(dashboard_data):
+    payload = {key: value for key, value in dashboard_data.items() if key != "version"}
+    version = content_hash(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8'), length=16)
+    dashboard_data["version"] = version
+
+    previous = load_json_file(DATA_SNAPSHOT)
+    version_info = load_json_file(DATA_VERSION_FILE) or {"version": None, "history": []}
+    history = version_info.get("history", [])
+
+    if previous and previous.get("version") and previous["version"] != version:
+        old_rows = {row["id"]: row for row in previous.get("detailedTableData", [])}
+        new_rows = {row["id"]: row for row in dashboard_data["detailedTableData"]}
+        patch = {
+            "from": previous["version"],
+            "to": version,
+            "upserts": [row for row_id, row in new_rows.items() if old_rows.get(row_id) != row],
+            "removed": [row_id for row_id in old_rows if row_id not in new_rows],
+            "aggregates": {key: value for key, value in dashboard_data.items() if key != "detailedTableData"},
+        }
+        write_output_file(os.path.join(DATA_PATCH_DIR, f"{previous['version']}-{version}.json"),
+                          json.dumps(patch, ensure_ascii=False, separators=(',', ':')))
+        print(f"Data changed {previous['version']} -> {version}: {len(patch['upserts'])} rows added/changed, {len(patch['removed'])} removed.")
+        if not history or history[-1] != previous["version"]:
+            history = [previous["version"]] # History does not connect to the previous build: start over
+        history = (history + [version])[-DATA_HISTORY_LENGTH:]
+    elif not history or history[-1] != version:
+        history = [version]
+
+    write_output_file(DATA_SNAPSHOT, json.dumps(dashboard_data, ensure_ascii=False, separators=(',', ':')))
+    write_output_file(DATA_VERSION_FILE, json.dumps({"version": version, "history": history}))
+
+    # Drop patches that are no longer reachable from the kept history
+    live_patches = {f"{a}-{b}.json" for a, b in zip(history, history[1:])}
+    if os.path.isdir(DATA_PATCH_DIR):
+        for name in os.listdir(DATA_PATCH_DIR):
+            if name.endswith('.json') and name not in live_patches:
+                os.remove(os.path.join(DATA_PATCH_DIR, name))
+            elif name in live_patches:
+                record_artifact(os.path.join(DATA_PATCH_DIR, name))
+    return version
+
+# Helper function to build the service worker: hashed assets and patches are served cache-first
+# (they never change), the page and other files stale-while-revalidate, and the data version
+# check always goes to the network so returning visitors learn about new data.
+# Lists the hashed assets and patches of this build, so that activating it evicts the cached ones
+# that the page and version history no longer reference (and sw.js changes whenever they do).
+def build_service_worker():
+    immutable_dirs = [ASSET_BUILD_DIR.replace(os.sep, '/') + '/', DATA_PATCH_DIR.replace(os.sep, '/') + '/']
+    live_paths = sorted(path for path in generated_artifacts if path.startswith(tuple(immutable_dirs)))
+    return f"""// Generated by generate_dashboard.py - do not edit
+const CACHE_NAME = '{SERVICE_WORKER_CACHE}';
+const IMMUTABLE_PATHS = {json.dumps(['/' + path for path in immutable_dirs])};
+const NETWORK_FIRST_PATHS = ['/{DATA_VERSION_FILE.replace(os.sep, '/')}', '/{DATA_SNAPSHOT.replace(os.sep, '/')}'];
+// Hashed assets and patches referenced by the current page and version history
+const LIVE_PATHS = {json.dumps(['/' + path for path in live_paths], indent=4)};
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', (event) => {{
+    event.waitUntil((async () => {{
+        const names = await caches.keys();
+        await Promise.all(names.filter(name => name !== CACHE_NAME).map(name => caches.delete(name)));
+        await evictUnreferenced();
+        await self.clients.claim();
+    }})());
+}});
+
+// Hashed file names never repeat, so without this every old bundle, background variant and patch
+// would stay in the cache forever
+async function evictUnreferenced() {{
+    const cache = await caches.open(CACHE_NAME);
+    const requests = await cache.keys();
+    await Promise.all(requests.filter(request => {{
+        const pathname = new URL(request.url).pathname;
+        return IMMUTABLE_PATHS.some(path => pathname.includes(path))
+            && !LIVE_PATHS.some(path => pathname.endsWith(path));
+    }}).map(request => cache.delete(request)));
+}}
+
+async function cacheFirst(request) {{
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(request);
+    if (cached) {{
+        return cached;
+    }}
+    const response = await fetch(request);
+    if (response.ok) {{
+        cache.put(request, response.clone());
+    }}
+    return response;
+}}
+
+async function networkFirst(request) {{
+    const cache = await caches.open(CACHE_NAME);
+    try {{
+        const response = await fetch(request, {{ cache: 'no-store' }});
+        if (response.ok) {{
+            cache.put(request, response.clone());
+        }}
+        return response;
+    }} catch (error) {{
+        const cached = await cache.match(request);
+        if (cached) {{
+            return cached;
+        }}
+        throw error;
+    }}
+}}
+
+async function staleWhileRevalidate(event) {{
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(event.request);
+    const network = fetch(event.request).then(response => {{
+        if (response.ok) {{
+            cache.put(event.request, response.clone());
+        }}
+        return response;
+    }});
+    if (cached) {{
+        event.waitUntil(network.catch(() => {{}})); // Refresh the cache for the next visit
+        return cached;
+    }}
+    return network;
+}}
+
+self.addEventListener('fetch', (event) => {{
+    const request = event.request;
+    const url = new URL(request.url);
+    // Only handle our own GET requests; fonts and CDN fallbacks use the normal HTTP cache
+    if (request.method !== 'GET' || url.origin !== self.location.origin) {{
+        return;
+    }}
+    if (NETWORK_FIRST_PATHS.some(path => url.pathname.endsWith(path))) {{
+        event.respondWith(networkFirst(request));
+    }} else if (IMMUTABLE_PATHS.some(path => url.pathname.includes(path))) {{
+        event.respondWith(cacheFirst(request));
+    }} else {{
+        event.respondWith(staleWhileRevalidate(event));
+    }}
+}});
+"""
+
+# Helper function to turn a partition value into an ASCII filename (e.g. "Ainaro" -> "ainaro")
+def slugify(value):
+    ascii_value = unicodedata.normalize('NFKD', str(value)).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '-', ascii_value.lower()).strip('-') or 'na'
+
+# Helper function to write one partition's CSV (and Parquet) file. Runs on the export thread pool.
+def write_partition_export(stem, frame, csv_bytes):
+    write_output_file(stem + '.csv', csv_bytes)
+    if HAS_PARQUET:
+        buffer = io.BytesIO()
+        frame.to_parquet(buffer, index=False)
+        write_output_file(stem + '.parquet', buffer.getvalue())
+
+# Helper function to write the combined Excel workbook: every row, then one sheet per municipality
+def write_export_workbook(frame, municipality_groups):
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        frame.to_excel(writer, sheet_name='Hotu', index=False)
+        used_names = {'Hotu'}
+        for value, positions in sorted(municipality_groups.items()):
+            # Excel sheet names: max 31 characters, no []:*?/\ and unique
+            name = re.sub(r'[\[\]:*?/\\]', '-', str(value))[:31] or 'N-A'
+            while name in used_names:
+                name = name[:28] + f"_{len(used_names)}"
+            used_names.add(name)
+            frame.iloc[positions].to_excel(writer, sheet_name=name, index=False)
+    write_output_file(EXPORT_WORKBOOK, buffer.getvalue())
+
+# Helper function to write the per-municipality and per-school-level exports of the detailed rows.
+# The rows are partitioned in a single pass, partitions whose content hash matches the previous
+# build are skipped, and the changed files are written concurrently. Returns the export links
+# for the page: {kind: [(label, csv path)], 'workbook': path or None}.
+def write_exports(rows):
+    if not rows:
+        # A failed or empty load would otherwise delete every published export as a removed partition
+        print("No detailed rows, keeping the existing exports.")
+        return None
+
+    columns = ['id'] + DETAILED_TABLE_COLUMNS
+    frame = pd.DataFrame([[row.get(column, 'N/A') for column in columns] for row in rows], columns=columns)
+
+    # One pass over the rows fills the buckets of every partition kind at once
+    buckets = {kind: {} for kind in EXPORT_PARTITIONS}
+    for position, row in enumerate(rows):
+        for kind, column in EXPORT_PARTITIONS.items():
+            buckets[kind].setdefault(row.get(column, 'N/A'), []).append(position)
+
+    previous = load_json_file(EXPORT_MANIFEST) or {}
+    extensions = ['.csv', '.parquet'] if HAS_PARQUET else ['.csv']
+    hashes = {}
+    jobs = []
+    links = {kind: [] for kind in EXPORT_PARTITIONS}
+    for kind, groups in buckets.items():
+        slugs = {slugify(value) for value in groups}
+        used = set()
+        for value, positions in sorted(groups.items()):
+            # Values sharing a slug get -2, -3, ... in sorted order, skipping names that are real slugs,
+            # so a partition keeps its filename as long as the values sharing its slug do not change
+            slug = base = slugify(value)
+            suffix = 1
+            while slug in used or (slug != base and slug in slugs):
+                suffix += 1
+                slug = f"{base}-{suffix}"
+            used.add(slug)
+            stem = f"{EXPORT_DIR}/{kind}/{slug}"
+            part = frame.iloc[positions]
+            csv_bytes = part.to_csv(index=False).encode('utf-8-sig') # BOM so Excel opens the accents correctly
+            hashes[stem] = hashlib.sha256(csv_bytes).hexdigest()
+            links[kind].append((str(value), stem + '.csv'))
+            paths = [stem + ext for ext in extensions]
+            if previous.get(stem) == hashes[stem] and all(os.path.exists(path) for path in paths):
+                for path in paths:
+                    record_artifact(path)
+                continue
+            jobs.append((stem, part, csv_bytes))
+
+    # The workbook changes whenever any partition does
+    workbook_hash = content_hash(json.dumps(hashes, sort_keys=True).encode('utf-8'), length=64)
+    workbook_changed = HAS_EXCEL and not (previous.get(EXPORT_WORKBOOK) == workbook_hash and os.path.exists(EXPORT_WORKBOOK))
+    if HAS_EXCEL:
+        hashes[EXPORT_WORKBOOK] = workbook_hash
+        if not workbook_changed:
+            record_artifact(EXPORT_WORKBOOK)
+    else:
+        print("openpyxl is not installed, skipping the Excel workbook.")
+    if not HAS_PARQUET:
+        print("pyarrow is not installed, skipping the Parquet exports.")
+
+    with ThreadPoolExecutor(max_workers=EXPORT_MAX_WORKERS) as pool:
+        futures = [pool.submit(write_partition_export, *job) for job in jobs]
+        if workbook_changed:
+            futures.append(pool.submit(write_export_workbook, frame, buckets['munisipiu']))
+        for future in futures:
+            future.result() # Re-raise errors from the workers
+
+    # Remove files of partitions that no longer exist
+    for kind in EXPORT_PARTITIONS:
+        directory = os.path.join(EXPORT_DIR, kind)
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            stem, ext = os.path.splitext(name)
+            if f"{EXPORT_DIR}/{kind}/{stem}" not in hashes or ext not in extensions:
+                os.remove(os.path.join(directory, name))
+
+    write_output_file(EXPORT_MANIFEST, json.dumps(hashes, indent=2, sort_keys=True, ensure_ascii=False) + "\n")
+    print(f"Exports: {len(jobs)} of {sum(len(groups) for groups in buckets.values())} partitions rewritten.")
+    links['workbook'] = EXPORT_WORKBOOK if HAS_EXCEL else None
+    return links
+
+# Helper function to render the download links for the exports below the detailed table
+def build_export_links_html(links):
+    if not links:
+        return ''
+    parts = []
+    if links.get('workbook'):
+        parts.append(f'<a href="./{links["workbook"]}" download class="text-blue-600 hover:underline font-semibold">Excel (hotu)</a>')
+    for kind, title in [('munisipiu', 'Munisípiu'), ('nivel-eskola', 'Nivel Eskola')]:
+        anchors = ", ".join(f'<a href="./{path}" download class="text-blue-600 hover:underline">{escape(label)}</a>' for label, path in links.get(kind, []))
+        if anchors:
+            parts.append(f'<p><span class="font-semibold">{title} (CSV):</span> {anchors}</p>')
+    return f'<div class="mt-6 text-sm text-gray-700 space-y-2"><h3 class="font-semibold text-gray-800">Download Dadus</h3>{"".join(parts)}</div>'
+
+# Metric -> agg_df column counted per partition by compute_partials()
+PARTIAL_COUNT_COLUMNS = {'gender': 'Seksu', 'age': 'Idade', 'schoolLevel': 'Nivel Eskola', 'discipline': 'Dixiplina'}
+
+# Helper function to create an empty partial: Counters for the counts, and the distinct topics as an exact
+# set (a boolean mask over the topic dictionary shared by all partials of one build; None while empty)
+def empty_partial():
+    return {
+        "rows": 0,
+        "municipality": Counter(), "gender": Counter(), "age": Counter(), "schoolLevel": Counter(),
+        "discipline": Counter(), "schoolMunicipality": Counter(), "topics": None,
+    }
+
+# Helper function to count the values of a column per partition without a Python loop over the rows:
+# (partition, value) pairs become one integer key, counted with np.unique. Missing values are skipped.
+# Yields (partition code, values, counts) for every partition that has values.
+def count_by_partition(partition_codes, column):
+    value_codes, values = pd.factorize(column)
+    present = value_codes >= 0
+    if not present.any():
+        return
+    keys, counts = np.unique(partition_codes[present].astype(np.int64) * len(values) + value_codes[present], return_counts=True)
+    partitions = keys // len(values)
+    values = values.take(keys % len(values))
+    # Keys are sorted, so each partition's entries are one contiguous slice
+    starts = np.flatnonzero(np.r_[True, partitions[1:] != partitions[:-1]])
+    ends = np.r_[starts[1:], len(keys)]
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        yield int(partitions[start]), values[start:end].tolist(), counts[start:end].tolist()
+
+# Helper function to compute the partials of every Munisipiu partition of agg_df, one vectorized
+# counting pass per metric. Returns {partition code: partial}; merge them with merge_partials().
+def compute_partials(agg_df):
+    codes, municipalities = pd.factorize(agg_df['Munisipiu'], use_na_sentinel=False) # Missing Munisipiu is its own partition
+    partials = {}
+    for code, rows in enumerate(np.bincount(codes, minlength=len(municipalities)).tolist()):
+        partial = empty_partial()
+        partial["rows"] = rows
+        municipality = municipalities[code]
+        if not pd.isna(municipality) and municipality != '':
+            partial["municipality"][municipality] = rows
+        partials[code] = partial
+
+    for metric, column in PARTIAL_COUNT_COLUMNS.items():
+        for code, values, counts in count_by_partition(codes, agg_df[column]):
+            partials[code][metric] = Counter(dict(zip(values, counts)))
+
+    for code, schools, counts in count_by_partition(codes, agg_df['Naran Eskola']):
+        if partials[code]["municipality"]: # Schools without a municipality are not in the School x Municipality table
+            municipality = municipalities[code]
+            partials[code]["schoolMunicipality"] = Counter({(municipality, school): count for school, count in zip(schools, counts)})
+
+    # One row of the mask per partition, filled with a single vectorized scatter
+    topic_codes, topics = pd.factorize(agg_df['Titulu/Tópiku'])
+    present = topic_codes >= 0
+    topic_masks = np.zeros((len(municipalities), len(topics)), dtype=bool)
+    topic_masks[codes[present], topic_codes[present]] = True
+    for code, partial in partials.items():
+        partial["topics"] = topic_masks[code]
+    return partials
+
+# Helper function to merge partials: counts add up, distinct topic masks are unioned
+def merge_partials(partials):
+    merged = empty_partial()
+    for partial in partials:
+        for key, value in partial.items():
+            if isinstance(value, Counter):
+                merged[key].update(value)
+            elif isinstance(value, np.ndarray):
+                merged[key] = value.copy() if merged[key] is None else merged[key] | value
+            else:
+                merged[key] += value
+    return merged
+
 # --- Step 1: Securely get the API key from the environment variable ---
 api_key = os.getenv("GOOGLE_SHEET_API_KEY")
 sheet_id = '1MYTD8Z_F408OPRSJos8JWS_0tgvM9Dmo6wlVKfZjrmM' # Replace with your Sheet ID if it's different
-
-# --- Step 2: Fetch data from the Google Sheets API ---
-dashboard_data = {
-    "totalMunicipality": 0,
-    "municipalityChartData": {"labels": [], "data": []},
-    "totalGender": 0,
-    "genderChartData": {"labels": [], "data": [], "percentages": []},
-    "ageDistribution": {},
-    "ageChartData": {"labels": [], "data": []},
-    "schoolLevelCounts": {},
-    "schoolLevelChartData": {"labels": [], "data": []},
-    "schoolMunicipalityTableData": [],
-    "totalDiscipline": 0,
-    "disciplineCounts": {},
-    "disciplineChartData": {"labels": [], "data": []},
-    "totalTopiku": 0,
-    "allNivelEskolaOptions": ["All"],
-    "allMunisipiuOptions": ["All"],
-    "detailedTableData": [],
-    "municipalityPieChartData": {"labels": [], "data": []}
-}
-
-try:
+sheet_fixture = os.getenv("SHEET_FIXTURE") # Optional: path to a recorded Sheets API response to use instead of the live API
+
+# Helper function to fetch the raw sheet rows (header row first)
+def fetch_sheet_values():
+    if sheet_fixture:
+        print(f"Reading recorded sheet response from {sheet_fixture}")
+        with open(sheet_fixture, 'r', encoding='utf-8') as f:
+            return json.load(f).get('values', [])
     url = f"https://sheets.googleapis.com/v4/spreadsheets/{sheet_id}/values/dadus?key={api_key}"
     response = requests.get(url)
     response.raise_for_status() # This will raise an HTTPError for bad responses (4xx or 5xx)
-    data = response.json().get('values', [])
+    return response.json().get('values', [])
 
-    # --- DEBUG PRINT: Raw data fetched from Google Sheets ---
-    print("--- Raw data fetched (first 5 rows): ---")
-    for i, row in enumerate(data):
-        if i < 5:
-            print(row)
-        else:
-            break
-    print("------------------------------------------")
+# --- Step 2: Fetch data from the Google Sheets API ---
+# Builds dashboard_data from the sheet rows (fetched if not given). Also used by serve_dashboard.py.
+# With strict=True a fetch/processing error or a sheet without rows is raised instead of returning the
+# empty defaults, so the build does not publish an empty dashboard over the last good one.
+def load_dashboard_data(data=None, strict=False):
+    dashboard_data = {
+        "totalMunicipality": 0,
+        "municipalityChartData": {"labels": [], "data": []},
+        "totalGender": 0,
+        "genderChartData": {"labels": [], "data": [], "percentages": []},
+        "ageDistribution": {},
+        "ageChartData": {"labels": [], "data": []},
+        "schoolLevelCounts": {},
+        "schoolLevelChartData": {"labels": [], "data": []},
+        # Compact School x Municipality table: rows are [Naran Eskola, Total] sorted by municipality then school,
+        # groups are [Munisipiu, start row, end row (exclusive), subtotal]
+        "schoolMunicipalityTable": {"rows": [], "groups": []},
+        "totalDiscipline": 0,
+        "disciplineCounts": {},
+        "disciplineChartData": {"labels": [], "data": []},
+        "totalTopiku": 0,
+        "allNivelEskolaOptions": ["All"],
+        "allMunisipiuOptions": ["All"],
+        "detailedTableData": [],
+        "municipalityPieChartData": {"labels": [], "data": []}
+    }
+
+    try:
+        if data is None:
+            data = fetch_sheet_values()
+
+        # --- DEBUG PRINT: Raw data fetched from Google Sheets ---
+        print("--- Raw data fetched (first 5 rows): ---")
+        for i, row in enumerate(data):
+            if i < 5:
+                print(row)
+            else:
+                break
+        print("------------------------------------------")
 
-    if data and len(data) > 0:
-        raw_headers = data[0]
-        data_rows = data[1:]
+        if data and len(data) > 0:
+            raw_headers = data[0]
+            data_rows = data[1:]
 
-        # Determine the maximum number of columns in the data rows
-        max_data_cols = 0
-        if data_rows:
-            max_data_cols = max(len(row) for row in data_rows)
-        else:
-            print("No data rows found after headers.")
-            # If no data rows, create an empty DataFrame with cleaned headers
-            cleaned_headers_for_empty_df = [clean_header_string(h) for h in raw_headers]
-            df = pd.DataFrame(columns=cleaned_headers_for_empty_df)
-            # Skip further processing if no data
-            raise ValueError("No data rows to process.") # Raise to jump to exception handler
-
-        # Slice raw_headers to match the maximum number of columns in data_rows
-        # This is crucial to avoid the "columns passed, passed data had X columns" error
-        adjusted_raw_headers = raw_headers[:max_data_cols]
-
-        # Create DataFrame with the adjusted raw headers
-        df = pd.DataFrame(data_rows, columns=adjusted_raw_headers)
-
-        # --- NEW: Explicitly rename columns using the cleaning function ---
-        # Create a dictionary for renaming: {old_name: new_cleaned_name}
-        rename_map = {col: clean_header_string(col) for col in df.columns}
-        df.rename(columns=rename_map, inplace=True)
-
-        # --- Handle duplicate column names that might arise after cleaning ---
-        # E.g., 'Seksu (Kanorin 1)' and 'Seksu (Kanorin 2)' both become 'Seksu'
-        cols = pd.Series(df.columns)
-        for dup in cols[cols.duplicated()].unique():
-            # Append _1, _2, _3 etc. to duplicates
-            # The first occurrence keeps the original cleaned name
-            indices_of_dup = cols[cols == dup].index.values.tolist()
-            for i, idx in enumerate(indices_of_dup):
-                if i == 0:
-                    cols[idx] = dup # First occurrence remains 'Seksu' or 'Idade'
-                else:
-                    cols[idx] = f"{dup}_{i}" # Subsequent occurrences get _1, _2, etc. (Seksu_1, Seksu_2)
-        df.columns = cols
-
-
-        # --- DEBUG PRINT: DataFrame head and columns (after ALL cleaning and renaming) ---
-        print("--- DataFrame Head (after ALL cleaning and renaming): ---")
-        print(df.head())
-        print("--- DataFrame Columns (after ALL cleaning and renaming): ---")
-        print(df.columns.tolist())
-        print("-----------------------------------------")
-
-        # --- DEBUG PRINT: Munisípiu column value_counts (df) ---
-        if 'Munisípiu' in df.columns:
-            print("--- Munisípiu column value_counts (df, before aggregation): ---")
-            print(df['Munisípiu'].value_counts(dropna=False))
-            print("----------------------------------")
-        else:
-            print("--- WARNING: 'Munisípiu' column not found in df after cleaning. ---")
-
-
-        # --- Data Aggregation for Dashboard Statistics ---
-        # Identify all Seksu and Idade columns based on their *newly unique* cleaned names
-        sek_cols_for_melt = [col for col in df.columns if col.startswith('Seksu') and not col.endswith('_Manorin')]
-        idade_cols_for_melt = [col for col in df.columns if col.startswith('Idade') and not col.endswith('_Manorin')]
-
-        # Create a list of DataFrames for each 'Kanorin' entry for aggregation
-        processed_records = []
-        # Iterate over the identified Seksu/Idade columns
-        for i, (sek_col, idade_col) in enumerate(zip(sek_cols_for_melt, idade_cols_for_melt)):
-            temp_df = df[[
-                'Munisípiu', # Use 'Munisípiu' with accent here
-                'Nivel Eskola', 'Naran Eskola',
-                'Dixiplina', 'Títulu/Tópiku Atividade', # Use 'Títulu/Tópiku Atividade' with accent here
-                sek_col, idade_col
-            ]].copy()
-            temp_df.rename(columns={
-                'Munisípiu': 'Munisipiu', # NEW: Rename to 'Munisipiu' without accent for consistency
-                sek_col: 'Seksu', # Rename back to simple 'Seksu' for aggregation
-                idade_col: 'Idade',   # Rename back to simple 'Idade' for aggregation
-                'Títulu/Tópiku Atividade': 'Titulu/Tópiku' # Standardize for dashboard
-            }, inplace=True)
-            processed_records.append(temp_df)
-
-
-        if processed_records:
-            # Concatenate all processed records into one DataFrame for aggregation
-            agg_df = pd.concat(processed_records, ignore_index=True)
+            # Determine the maximum number of columns in the data rows
+            max_data_cols = 0
+            if data_rows:
+                max_data_cols = max(len(row) for row in data_rows)
+            else:
+                print("No data rows found after headers.")
+                # If no data rows, create an empty DataFrame with cleaned headers
+                cleaned_headers_for_empty_df = [clean_header_string(h) for h in raw_headers]
+                df = pd.DataFrame(columns=cleaned_headers_for_empty_df)
+                # Skip further processing if no data
+                raise ValueError("No data rows to process.") # Raise to jump to exception handler
+
+            # Slice raw_headers to match the maximum number of columns in data_rows
+            # This is crucial to avoid the "columns passed, passed data had X columns" error
+            adjusted_raw_headers = raw_headers[:max_data_cols]
+
+            # Create DataFrame with the adjusted raw headers
+            df = pd.DataFrame(data_rows, columns=adjusted_raw_headers)
+
+            # --- NEW: Explicitly rename columns using the cleaning function ---
+            # Create a dictionary for renaming: {old_name: new_cleaned_name}
+            rename_map = {col: clean_header_string(col) for col in df.columns}
+            df.rename(columns=rename_map, inplace=True)
+
+            # --- Handle duplicate column names that might arise after cleaning ---
+            # E.g., 'Seksu (Kanorin 1)' and 'Seksu (Kanorin 2)' both become 'Seksu'
+            cols = pd.Series(df.columns)
+            for dup in cols[cols.duplicated()].unique():
+                # Append _1, _2, _3 etc. to duplicates
+                # The first occurrence keeps the original cleaned name
+                indices_of_dup = cols[cols == dup].index.values.tolist()
+                for i, idx in enumerate(indices_of_dup):
+                    if i == 0:
+                        cols[idx] = dup # First occurrence remains 'Seksu' or 'Idade'
+                    else:
+                        cols[idx] = f"{dup}_{i}" # Subsequent occurrences get _1, _2, etc. (Seksu_1, Seksu_2)
+            df.columns = cols
+
+
+            # --- DEBUG PRINT: DataFrame head and columns (after ALL cleaning and renaming) ---
+            print("--- DataFrame Head (after ALL cleaning and renaming): ---")
+            print(df.head())
+            print("--- DataFrame Columns (after ALL cleaning and renaming): ---")
+            print(df.columns.tolist())
+            print("-----------------------------------------")
+
+            # --- DEBUG PRINT: Munisípiu column value_counts (df) ---
+            if 'Munisípiu' in df.columns:
+                print("--- Munisípiu column value_counts (df, before aggregation): ---")
+                print(df['Munisípiu'].value_counts(dropna=False))
+                print("----------------------------------")
+            else:
+                print("--- WARNING: 'Munisípiu' column not found in df after cleaning. ---")
+
+
+            # --- Data Aggregation for Dashboard Statistics ---
+            # Identify all Seksu and Idade columns based on their *newly unique* cleaned names
+            sek_cols_for_melt = [col for col in df.columns if col.startswith('Seksu') and not col.endswith('_Manorin')]
+            idade_cols_for_melt = [col for col in df.columns if col.startswith('Idade') and not col.endswith('_Manorin')]
+
+            # Create a list of DataFrames for each 'Kanorin' entry for aggregation
+            processed_records = []
+            # Iterate over the identified Seksu/Idade columns
+            for i, (sek_col, idade_col) in enumerate(zip(sek_cols_for_melt, idade_cols_for_melt)):
+                temp_df = df[[
+                    'Munisípiu', # Use 'Munisípiu' with accent here
+                    'Nivel Eskola', 'Naran Eskola',
+                    'Dixiplina', 'Títulu/Tópiku Atividade', # Use 'Títulu/Tópiku Atividade' with accent here
+                    sek_col, idade_col
+                ]].copy()
+                temp_df.rename(columns={
+                    'Munisípiu': 'Munisipiu', # NEW: Rename to 'Munisipiu' without accent for consistency
+                    sek_col: 'Seksu', # Rename back to simple 'Seksu' for aggregation
+                    idade_col: 'Idade',   # Rename back to simple 'Idade' for aggregation
+                    'Títulu/Tópiku Atividade': 'Titulu/Tópiku' # Standardize for dashboard
+                }, inplace=True)
+                processed_records.append(temp_df)
+
+
+            if processed_records:
+                # Concatenate all processed records into one DataFrame for aggregation
+                agg_df = pd.concat(processed_records, ignore_index=True)
             
-            # Clean whitespace from 'Munisipiu' and replace empty strings with NaN
-            if 'Munisipiu' in agg_df.columns:
-                agg_df['Munisipiu'] = agg_df['Munisipiu'].astype(str).str.strip()
-                agg_df['Munisipiu'] = agg_df['Munisipiu'].replace('', pd.NA) # Replace empty strings with NA
+                # Clean whitespace from 'Munisipiu' and replace empty strings with NaN
+                if 'Munisipiu' in agg_df.columns:
+                    agg_df['Munisipiu'] = agg_df['Munisipiu'].astype(str).str.strip()
+                    agg_df['Munisipiu'] = agg_df['Munisipiu'].replace('', pd.NA) # Replace empty strings with NA
             
-            # Drop rows where Seksu or Idade are empty/None
-            agg_df = agg_df.dropna(subset=['Seksu', 'Idade'], how='all')
-
-            # Convert 'Idade' to numeric, coercing errors to NaN
-            print("--- Idade column before numeric conversion (agg_df): ---")
-            print(agg_df['Idade'].head())
-            agg_df['Idade'] = pd.to_numeric(agg_df['Idade'], errors='coerce')
-            print("--- Idade column after numeric conversion (agg_df): ---")
-            print(agg_df['Idade'].head())
-            print("---------------------------------------------")
-
-            # --- DEBUG PRINT: Seksu column value counts (agg_df) ---
-            print("--- Seksu column value_counts (agg_df): ---")
-            print(agg_df['Seksu'].value_counts(dropna=False))
-            print("----------------------------------")
-
-            # --- DEBUG PRINT: Munisipiu column value_counts (agg_df) ---
-            if 'Munisipiu' in agg_df.columns:
-                print("--- Munisipiu column value_counts (agg_df, after aggregation and cleaning): ---")
-                print(agg_df['Munisipiu'].value_counts(dropna=False))
+                # Drop rows where Seksu or Idade are empty/None
+                agg_df = agg_df.dropna(subset=['Seksu', 'Idade'], how='all')
+
+                # Convert 'Idade' to numeric, coercing errors to NaN
+                print("--- Idade column before numeric conversion (agg_df): ---")
+                print(agg_df['Idade'].head())
+                agg_df['Idade'] = pd.to_numeric(agg_df['Idade'], errors='coerce')
+                print("--- Idade column after numeric conversion (agg_df): ---")
+                print(agg_df['Idade'].head())
+                print("---------------------------------------------")
+
+                # --- DEBUG PRINT: Seksu column value counts (agg_df) ---
+                print("--- Seksu column value_counts (agg_df): ---")
+                print(agg_df['Seksu'].value_counts(dropna=False))
                 print("----------------------------------")
-            else:
-                print("--- WARNING: 'Munisipiu' column not found in agg_df after aggregation. ---")
-
-
-            # --- Data Processing for Dashboard using agg_df ---
-            dashboard_data["totalMunicipality"] = agg_df['Munisipiu'].nunique(dropna=True) if 'Munisipiu' in agg_df.columns else 0
-
-            municipality_counts = agg_df['Munisipiu'].value_counts().sort_index() if 'Munisipiu' in agg_df.columns else pd.Series()
-            # Filter out empty/NA values from labels and data for charts
-            municipality_counts = municipality_counts[municipality_counts.index.notna() & (municipality_counts.index != '')]
-            dashboard_data["municipalityChartData"]["labels"] = municipality_counts.index.tolist()
-            dashboard_data["municipalityChartData"]["data"] = municipality_counts.values.tolist()
-            dashboard_data["municipalityPieChartData"] = dashboard_data["municipalityChartData"]
-
-            gender_counts = agg_df['Seksu'].value_counts() if 'Seksu' in agg_df.columns else pd.Series()
-            dashboard_data["totalGender"] = len(agg_df) # Total participants
-            dashboard_data["genderChartData"]["labels"] = gender_counts.index.tolist()
-            dashboard_data["genderChartData"]["data"] = gender_counts.values.tolist()
-            dashboard_data["genderChartData"]["percentages"] = [f"{{{{ (val / dashboard_data['totalGender'] * 100):.1f}}}}%" for val in gender_counts.values] if dashboard_data['totalGender'] > 0 else []
-
-            age_distribution = agg_df['Idade'].value_counts().sort_index().to_dict() if 'Idade' in agg_df.columns else {}
-            dashboard_data["ageDistribution"] = {str(k): int(v) for k, v in age_distribution.items()}
-            dashboard_data["ageChartData"]["labels"] = [str(age) for age in sorted(agg_df['Idade'].dropna().unique().tolist())] if 'Idade' in agg_df.columns else []
-            dashboard_data["ageChartData"]["data"] = [int(age_distribution.get(label, 0)) for label in dashboard_data["ageChartData"]["labels"]]
-
-            school_level_counts = agg_df['Nivel Eskola'].value_counts().sort_index() if 'Nivel Eskola' in agg_df.columns else pd.Series()
-            dashboard_data["schoolLevelCounts"] = school_level_counts.to_dict()
-            dashboard_data["schoolLevelChartData"]["labels"] = school_level_counts.index.tolist()
-            dashboard_data["schoolLevelChartData"]["data"] = school_level_counts.values.tolist()
-
-            school_municipality_grouped = agg_df.groupby(['Munisipiu', 'Naran Eskola']).size().reset_index(name='Total') if 'Munisipiu' in agg_df.columns and 'Naran Eskola' in agg_df.columns else pd.DataFrame()
-            dashboard_data["schoolMunicipalityTableData"] = school_municipality_grouped.to_dict(orient='records')
-
-            discipline_counts = agg_df['Dixiplina'].value_counts().sort_index() if 'Dixiplina' in agg_df.columns else pd.Series()
-            dashboard_data["totalDiscipline"] = agg_df['Dixiplina'].nunique() if 'Dixiplina' in agg_df.columns else 0
-            dashboard_data["disciplineCounts"] = discipline_counts.to_dict()
-            dashboard_data["disciplineChartData"]["labels"] = discipline_counts.index.tolist()
-            dashboard_data["disciplineChartData"]["data"] = discipline_counts.values.tolist()
-
-            dashboard_data["totalTopiku"] = agg_df['Titulu/Tópiku'].nunique() if 'Titulu/Tópiku' in agg_df.columns else 0
-
-            dashboard_data["allNivelEskolaOptions"] = ["All"] + sorted(agg_df['Nivel Eskola'].dropna().unique().tolist()) if 'Nivel Eskola' in agg_df.columns else ["All"]
-            dashboard_data["allMunisipiuOptions"] = ["All"] + sorted(agg_df['Munisipiu'].dropna().unique().tolist()) if 'Munisipiu' in agg_df.columns else ["All"]
-
-            # Detailed Table Data - Use the original df (with cleaned and unique headers) for this
-            detailed_data_for_html = []
-            for index, row in df.iterrows():
-                row_dict = {}
-                row_dict['Munisipiu'] = row.get('Munisípiu', 'N/A') # Use 'Munisípiu' with accent
+
+                # --- DEBUG PRINT: Munisipiu column value_counts (agg_df) ---
+                if 'Munisipiu' in agg_df.columns:
+                    print("--- Munisipiu column value_counts (agg_df, after aggregation and cleaning): ---")
+                    print(agg_df['Munisipiu'].value_counts(dropna=False))
+                    print("----------------------------------")
+                else:
+                    print("--- WARNING: 'Munisipiu' column not found in agg_df after aggregation. ---")
+
+
+                # --- Data Processing for Dashboard using agg_df ---
+                # Per-Munisipiu partials (vectorized), merged into the dashboard totals
+                totals = merge_partials(compute_partials(agg_df).values())
+
+                dashboard_data["totalMunicipality"] = len(totals["municipality"])
+
+                municipality_labels = sorted(totals["municipality"])
+                dashboard_data["municipalityChartData"]["labels"] = municipality_labels
+                dashboard_data["municipalityChartData"]["data"] = [totals["municipality"][label] for label in municipality_labels]
+                dashboard_data["municipalityPieChartData"] = dashboard_data["municipalityChartData"]
+
+                # Most common first, ties alphabetically
+                gender_counts = sorted(totals["gender"].items(), key=lambda item: (-item[1], str(item[0])))
+                dashboard_data["totalGender"] = totals["rows"] # Total participants
+                dashboard_data["genderChartData"]["labels"] = [label for label, _ in gender_counts]
+                dashboard_data["genderChartData"]["data"] = [count for _, count in gender_counts]
+
+                sorted_ages = sorted(totals["age"])
+                dashboard_data["ageDistribution"] = {str(age): totals["age"][age] for age in sorted_ages}
+                dashboard_data["ageChartData"]["labels"] = [str(age) for age in sorted_ages]
+                dashboard_data["ageChartData"]["data"] = [totals["age"][age] for age in sorted_ages]
+
+                school_levels = sorted(totals["schoolLevel"])
+                dashboard_data["schoolLevelCounts"] = {level: totals["schoolLevel"][level] for level in school_levels}
+                dashboard_data["schoolLevelChartData"]["labels"] = school_levels
+                dashboard_data["schoolLevelChartData"]["data"] = [totals["schoolLevel"][level] for level in school_levels]
+
+                if totals["schoolMunicipality"]:
+                    table_rows = []
+                    table_groups = []
+                    # Per-municipality index and subtotals, so the page can render and collapse groups without scanning rows
+                    for municipality, school in sorted(totals["schoolMunicipality"]):
+                        if not table_groups or table_groups[-1][0] != str(municipality):
+                            table_groups.append([str(municipality), len(table_rows), len(table_rows), 0])
+                        total = totals["schoolMunicipality"][(municipality, school)]
+                        table_rows.append([str(school), total])
+                        table_groups[-1][2] = len(table_rows)
+                        table_groups[-1][3] += total
+                    dashboard_data["schoolMunicipalityTable"] = {"rows": table_rows, "groups": table_groups}
+
+                disciplines = sorted(totals["discipline"])
+                dashboard_data["totalDiscipline"] = len(disciplines)
+                dashboard_data["disciplineCounts"] = {discipline: totals["discipline"][discipline] for discipline in disciplines}
+                dashboard_data["disciplineChartData"]["labels"] = disciplines
+                dashboard_data["disciplineChartData"]["data"] = [totals["discipline"][discipline] for discipline in disciplines]
+
+                dashboard_data["totalTopiku"] = int(totals["topics"].sum()) if totals["topics"] is not None else 0 # Exact distinct count (union of the partition masks)
+
+                dashboard_data["allNivelEskolaOptions"] = ["All"] + school_levels
+                dashboard_data["allMunisipiuOptions"] = ["All"] + municipality_labels
+
+                # Detailed Table Data - Use the original df (with cleaned and unique headers) for this
+                detailed_data_for_html = []
+                for index, row in df.iterrows():
+                    row_dict = {}
+                    row_dict['id'] = str(index) # Sheet row position, used to match rows between builds for delta patches
+                    row_dict['Munisipiu'] = row.get('Munisípiu', 'N/A') # Use 'Munisípiu' with accent
                 
-                # Combine all Seksu and Idade values for display in the detailed table
-                all_seksu_in_row = [row[col] for col in sek_cols_for_melt if pd.notna(row[col]) and row[col] != '']
-                all_idade_in_row = [row[col] for col in idade_cols_for_melt if pd.notna(row[col]) and row[col] != '']
+                    # Combine all Seksu and Idade values for display in the detailed table
+                    all_seksu_in_row = [row[col] for col in sek_cols_for_melt if pd.notna(row[col]) and row[col] != '']
+                    all_idade_in_row = [row[col] for col in idade_cols_for_melt if pd.notna(row[col]) and row[col] != '']
 
-                row_dict['Seksu'] = ', '.join(all_seksu_in_row) if all_seksu_in_row else 'N/A'
-                row_dict['Idade'] = ', '.join(map(str, all_idade_in_row)) if all_idade_in_row else 'N/A'
+                    row_dict['Seksu'] = ', '.join(all_seksu_in_row) if all_seksu_in_row else 'N/A'
+                    row_dict['Idade'] = ', '.join(map(str, all_idade_in_row)) if all_idade_in_row else 'N/A'
                 
-                row_dict['Dixiplina'] = row.get('Dixiplina', 'N/A')
-                row_dict['Nivel Eskola'] = row.get('Nivel Eskola', 'N/A')
-                row_dict['Naran Eskola'] = row.get('Naran Eskola', 'N/A')
-                row_dict['Titulu/Tópiku'] = row.get('Títulu/Tópiku Atividade', 'N/A') # Use 'Títulu/Tópiku Atividade' with accent
-                row_dict['Timestamp'] = row.get('Timestamp', 'N/A')
+                    row_dict['Dixiplina'] = row.get('Dixiplina', 'N/A')
+                    row_dict['Nivel Eskola'] = row.get('Nivel Eskola', 'N/A')
+                    row_dict['Naran Eskola'] = row.get('Naran Eskola', 'N/A')
+                    row_dict['Titulu/Tópiku'] = row.get('Títulu/Tópiku Atividade', 'N/A') # Use 'Títulu/Tópiku Atividade' with accent
+                    row_dict['Timestamp'] = row.get('Timestamp', 'N/A')
                 
-                detailed_data_for_html.append(row_dict)
+                    detailed_data_for_html.append(row_dict)
 
-            dashboard_data["detailedTableData"] = detailed_data_for_html
+                dashboard_data["detailedTableData"] = detailed_data_for_html
             
-            # Convert values to string and handle NaN/empty for detailed table
-            for row in dashboard_data["detailedTableData"]:
-                row['id'] = str(row.get('id', index)) # Use index as default id if not present
-                for key, value in row.items():
-                    if pd.isna(value) or value == '':
-                        row[key] = 'N/A'
-                    elif isinstance(value, (int, float)):
-                        row[key] = str(value)
-        else:
-            dashboard_data["detailedTableData"] = []
+                # Convert values to string and handle NaN/empty for detailed table
+                for row in dashboard_data["detailedTableData"]:
+                    for key, value in row.items():
+                        if pd.isna(value) or value == '':
+                            row[key] = 'N/A'
+                        elif isinstance(value, (int, float)):
+                            row[key] = str(value)
+            else:
+                dashboard_data["detailedTableData"] = []
 
 
+        else:
+            print("No data found in Google Sheet or sheet is empty.")
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data: {e}")
+        traceback.print_exc()
+        if strict:
+            raise
+    except Exception as e:
+        print(f"An unexpected error occurred during data processing: {e}")
+        traceback.print_exc()
+        if strict:
+            raise
+
+    if strict and not dashboard_data["detailedTableData"]:
+        raise RuntimeError("No rows loaded from the Google Sheet")
+
+    # --- Step 2a: Prepare chart-ready payloads (colors, percentages, top-N) ---
+    dashboard_data["genderChartData"] = prepare_chart_payload(dashboard_data["genderChartData"])
+    dashboard_data["ageChartData"] = prepare_chart_payload(dashboard_data["ageChartData"]) # Keeps age order
+    dashboard_data["disciplineChartData"] = prepare_chart_payload(dashboard_data["disciplineChartData"], top_n=CHART_TOP_N)
+    dashboard_data["schoolLevelChartData"] = prepare_chart_payload(dashboard_data["schoolLevelChartData"], top_n=CHART_TOP_N)
+    dashboard_data["municipalityChartData"] = prepare_chart_payload(dashboard_data["municipalityChartData"], top_n=CHART_TOP_N)
+    dashboard_data["municipalityPieChartData"] = dashboard_data["municipalityChartData"]
+    return dashboard_data
+
+
+# Builds the dashboard assets and writes index.html
+def main():
+    # Stop before writing anything (page, exports, data versions, patches) when the data could not be
+    # loaded: a transient API failure must not publish an empty snapshot and a patch removing every row
+    try:
+        dashboard_data = load_dashboard_data(strict=True)
+    except Exception as e:
+        print(f"Data could not be loaded ({e}); keeping the published dashboard unchanged.")
+        sys.exit(1)
+
+    # --- Step 2b: Resize and re-encode the background image ---
+    try:
+        background_assets = process_background_image(BACKGROUND_IMAGE)
+    except Exception as e:
+        print(f"Error processing background image: {e}")
+        traceback.print_exc()
+        background_assets = None
+    background_css = build_background_css(background_assets)
+
+    # --- Step 2c: Bundle the vendored chart and PDF libraries ---
+    print("Building front-end bundles...")
+    chart_bundle_url = build_vendor_bundle('charts', CHART_BUNDLE)
+    pdf_bundle_url = build_vendor_bundle('pdf', PDF_BUNDLE)
+    if chart_bundle_url:
+        chart_script_tags = f'<script defer src="{chart_bundle_url}"></script>'
     else:
-        print("No data found in Google Sheet or sheet is empty.")
-
-except requests.exceptions.RequestException as e:
-    print(f"Error fetching data: {e}")
-    traceback.print_exc()
-except Exception as e:
-    print(f"An unexpected error occurred during data processing: {e}")
-    traceback.print_exc()
-
-
-# --- Step 3: Define the full HTML content with embedded data ---
-html_content = f"""
+        chart_script_tags = "\n    ".join(f'<script defer src="{VENDOR_SCRIPTS[name][0]}"></script>' for name in CHART_BUNDLE)
+    # The PDF libraries are only fetched when the user asks for a PDF
+    pdf_script_urls = [pdf_bundle_url] if pdf_bundle_url else [VENDOR_SCRIPTS[name][0] for name in PDF_BUNDLE]
+
+    # --- Step 2d: Write the per-municipality and per-school-level exports ---
+    try:
+        export_links = write_exports(dashboard_data["detailedTableData"])
+    except Exception as e:
+        print(f"Error writing exports: {e}")
+        traceback.print_exc()
+        export_links = None
+    export_links_html = build_export_links_html(export_links)
+
+    # --- Step 2e: Version the data and write the delta patch ---
+    try:
+        data_version = write_data_versions(dashboard_data)
+    except Exception as e:
+        print(f"Error writing data versions: {e}")
+        traceback.print_exc()
+        dashboard_data["version"] = None # The page then skips the delta update check
+
+    # The detailed rows are embedded once as compact JSON text for the table worker, not in dashboardData
+    page_data = {key: value for key, value in dashboard_data.items() if key != "detailedTableData"}
+    detailed_table_json = json.dumps(dashboard_data["detailedTableData"], ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
+
+    # --- Step 3: Define the full HTML content with embedded data ---
+    html_content = f"""
 <!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Demographic Dashboard Report</title>
-    <script src="https://cdn.tailwindcss.com"></script>
+    <!-- TAILWIND_STYLESHEET -->
     <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600;700;800&display=swap" rel="stylesheet">
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-    <script src="https://cdn.jsdelivr.net/npm/chartjs-plugin-datalabels@2.0.0"></script>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/html2canvas/1.4.1/html2canvas.min.js"></script>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/jspdf/2.5.1/jspdf.umd.min.js"></script>
+    {chart_script_tags}
     <style>
         body {{
             font-family: 'Inter', sans-serif;
         }}
         
         body {{
-            background-image: url('./assets/AY1A8030.jpg'); /* Updated: Suggested path for your background image */
             background-size: cover;
             background-repeat: no-repeat;
             background-position: center center;
             background-attachment: fixed;
         }}
+        /* Responsive background variants generated by the asset pipeline */
+        {background_css}
         .bg-white, .bg-blue-50 {{
             background-color: rgba(255, 255, 255, 0.9);
         }}
@@ -443,7 +1389,7 @@ html_content = f"""
         <div class="bg-white p-6 rounded-xl shadow-lg hover:shadow-xl transition-shadow duration-300 transform hover:-translate-y-1 md:col-span-2 lg:col-span-2">
             <h2 class="text-2xl font-bold text-indigo-700 mb-3">Tabela kona-ba eskola ne'ebé rejistu hosi kada Munisípiu</h2>
             <div class="max-h-60 overflow-y-auto rounded-lg border border-gray-200 shadow-sm">
-                <table class="min-w-full divide-y divide-gray-200">
+                <table id="schoolMunicipalityTable" class="min-w-full divide-y divide-gray-200">
                     <thead class="bg-blue-50">
                         <tr>
                             <th scope="col" class="px-4 py-2 text-left text-xs font-medium text-blue-700 uppercase tracking-wider">Munisípiu</th>
@@ -451,8 +1397,7 @@ html_content = f"""
                             <th scope="col" class="px-4 py-2 text-left text-xs font-medium text-blue-700 uppercase tracking-wider">Totál</th>
                         </tr>
                     </thead>
-                    <tbody class="bg-white divide-y divide-gray-100" id="schoolMunicipalityTableBody">
-                        </tbody>
+                    <!-- One <tbody> per municipality is added by renderSchoolMunicipalityTable() -->
                 </table>
             </div>
         </div>
@@ -526,17 +1471,50 @@ html_content = f"""
                 Tuirmai
             </button>
         </div>
+        {export_links_html}
     </section>
 
     <footer class="text-center text-gray-600 text-sm mt-10">
         <p>&copy; Relatóriu Atuál Rejistrasaun LMSM 2025, SESIM-KNTLU. All rights reserved.</p>
     </footer>
 
+    <script id="table-worker-source" type="javascript/worker">{TABLE_WORKER_JS}</script>
+    <script id="detailed-table-data" type="application/json">{detailed_table_json}</script>
     <script>
         // Define the password for PDF editing (basic deterrent only)
         const PDF_EDIT_PASSWORD = 'your_strong_edit_password'; // <--- CHANGE THIS PASSWORD!
 
+        // html2canvas and jsPDF are only downloaded the first time a PDF is requested
+        const PDF_SCRIPT_URLS = {json.dumps(pdf_script_urls)};
+        let pdfLibrariesPromise = null;
+
+        function loadScript(src) {{
+            return new Promise((resolve, reject) => {{
+                const script = document.createElement('script');
+                script.src = src;
+                script.onload = resolve;
+                script.onerror = () => reject(new Error(`Failed to load ${{src}}`));
+                document.head.appendChild(script);
+            }});
+        }}
+
+        function loadPdfLibraries() {{
+            if (!pdfLibrariesPromise) {{
+                // Load sequentially to keep the same order as the old <script> tags
+                pdfLibrariesPromise = PDF_SCRIPT_URLS.reduce((chain, src) => chain.then(() => loadScript(src)), Promise.resolve());
+                pdfLibrariesPromise.catch(() => {{ pdfLibrariesPromise = null; }}); // Allow a retry after a network error
+            }}
+            return pdfLibrariesPromise;
+        }}
+
         async function downloadPdf() {{
+            await loadPdfLibraries();
+            instantiateAllCharts(); // Charts below the fold may not exist yet
+            // Skip the entry animation so html2canvas captures every chart fully drawn, not mid-animation
+            chartInstances.forEach(chart => {{
+                chart.stop();
+                chart.update('none');
+            }});
             const {{ jsPDF }} = window.jspdf;
             const dashboardContent = document.getElementById('summary-section'); // Capture only the summary section for PDF
 
@@ -577,12 +1555,10 @@ html_content = f"""
         }}
 
 
-        // Register Chart.js Datalabels plugin globally
-        Chart.register(ChartDataLabels);
-
         // Embed the processed data directly into a JavaScript variable
         // THIS WILL BE REPLACED BY THE PYTHON SCRIPT
-        const dashboardData = {json.dumps(dashboard_data, indent=4)};
+        const dashboardData = {json.dumps(page_data, indent=4)};
+        const DETAILED_TABLE_COLUMNS = {json.dumps(DETAILED_TABLE_COLUMNS, ensure_ascii=False)};
 
         let currentPage = 1;
         let rowsPerPage = 10;
@@ -590,29 +1566,29 @@ html_content = f"""
         let currentNivelEskolaFilter = 'All';
         let currentMunisipiuFilter = 'All'; // New: Variable for Munisipiu filter
 
-        // Utility to generate consistent colors
-        function generateColors(numColors) {{
-            const colors = [
-                'rgba(75, 192, 192, 0.6)', 'rgba(153, 102, 255, 0.6)', 'rgba(255, 159, 64, 0.6)',
-                'rgba(255, 99, 132, 0.6)', 'rgba(54, 162, 235, 0.6)', 'rgba(201, 203, 207, 0.6)',
-                'rgba(255, 205, 86, 0.6)', 'rgba(100, 149, 237, 0.6)', 'rgba(255, 0, 255, 0.6)',
-                'rgba(0, 255, 0, 0.6)', 'rgba(0, 0, 255, 0.6)', 'rgba(128, 0, 128, 0.6)'
-            ];
-            return Array.from({{length: numColors}}, (_, i) => colors[i % colors.length]);
-        }}
-
-        // Function to create a generic Bar Chart
-        function createBarChart(canvasId, title, labels, data) {{
+        // Chart factories keyed by canvas id, charts that have not been created yet, and created charts
+        const chartFactories = {{
+            genderChart: () => createPieChart('genderChart', 'Persentajen tuir Jéneru', dashboardData.genderChartData),
+            ageChart: () => createBarChart('ageChart', 'Distribuisaun tuir Idade', dashboardData.ageChartData),
+            disciplineChart: () => createBarChart('disciplineChart', 'Tópiku tuir kada Dixiplina', dashboardData.disciplineChartData),
+            schoolLevelChart: () => createBarChart('schoolLevelChart', 'Distribuisaun Tópiku tuir Nivel Eskola', dashboardData.schoolLevelChartData),
+            municipalityChart: () => createBarChart('municipalityChart', 'Distribuisaun Tópiku tuir Munisípiu', dashboardData.municipalityChartData)
+        }};
+        const pendingCharts = new Map();
+        const chartInstances = new Map();
+
+        // Function to create a generic Bar Chart from a precomputed payload
+        function createBarChart(canvasId, title, chartData) {{
             const ctx = document.getElementById(canvasId).getContext('2d');
-            new Chart(ctx, {{
+            return new Chart(ctx, {{
                 type: 'bar',
                 data: {{
-                    labels: labels,
+                    labels: chartData.labels,
                     datasets: [{{
                         label: 'Totál',
-                        data: data,
-                        backgroundColor: generateColors(labels.length),
-                        borderColor: generateColors(labels.length).map(color => color.replace('0.6', '1')),
+                        data: chartData.data,
+                        backgroundColor: chartData.backgroundColor,
+                        borderColor: chartData.borderColor,
                         borderWidth: 1
                     }}]
                 }},
@@ -648,17 +1624,17 @@ html_content = f"""
             }});
         }}
 
-        // Function to create a generic Pie Chart
-        function createPieChart(canvasId, title, labels, data) {{
+        // Function to create a generic Pie Chart from a precomputed payload
+        function createPieChart(canvasId, title, chartData) {{
             const ctx = document.getElementById(canvasId).getContext('2d');
-            new Chart(ctx, {{
+            return new Chart(ctx, {{
                 type: 'pie',
                 data: {{
-                    labels: labels,
+                    labels: chartData.labels,
                     datasets: [{{
                         label: 'Pursentu',
-                        data: data,
-                        backgroundColor: generateColors(labels.length),
+                        data: chartData.data,
+                        backgroundColor: chartData.backgroundColor,
                         borderColor: '#fff',
                         borderWidth: 2
                     }}]
@@ -676,15 +1652,8 @@ html_content = f"""
                             position: 'bottom'
                         }},
                         datalabels: {{
-                            formatter: (value, ctx) => {{
-                                let sum = 0;
-                                let dataArr = ctx.chart.data.datasets[0].data;
-                                dataArr.map(data => {{
-                                    sum += data;
-                                }});
-                                let percentage = (value * 100 / sum).toFixed(1) + "%";
-                                return percentage;
-                            }},
+                            // Percentages are computed by the Python script
+                            formatter: (value, ctx) => chartData.percentages[ctx.dataIndex],
                             color: '#fff',
                             font: {{
                                 weight: 'bold',
@@ -696,29 +1665,99 @@ html_content = f"""
             }});
         }}
 
-        // Function to render the detailed table
-        function renderDetailedTable() {{
-            const tableBody = document.createElement('tbody');
-            tableBody.className = "bg-white divide-y divide-gray-100";
-            const filteredData = dashboardData.detailedTableData.filter(row => {{
-                const matchesSearch = currentSearchTerm === '' ||
-                                      Object.values(row).some(value =>
-                                          String(value).toLowerCase().includes(currentSearchTerm.toLowerCase())
-                                      );
-                const matchesNivelEskola = currentNivelEskolaFilter === 'All' ||
-                                           row['Nivel Eskola'] === currentNivelEskolaFilter;
-                const matchesMunisipiu = currentMunisipiuFilter === 'All' ||
-                                         row['Munisipiu'] === currentMunisipiuFilter;
-                return matchesSearch && matchesNivelEskola && matchesMunisipiu;
+        // Create a pending chart (no-op if it already exists)
+        function instantiateChart(canvasId) {{
+            const create = pendingCharts.get(canvasId);
+            if (create) {{
+                pendingCharts.delete(canvasId);
+                chartInstances.set(canvasId, create());
+            }}
+        }}
+
+        // Create every chart that has not scrolled into view yet (e.g. before exporting the PDF)
+        function instantiateAllCharts() {{
+            Array.from(pendingCharts.keys()).forEach(instantiateChart);
+        }}
+
+        // Register the charts and only create each one when its canvas approaches the viewport
+        function setupLazyCharts() {{
+            Object.entries(chartFactories).forEach(([canvasId, create]) => pendingCharts.set(canvasId, create));
+
+            if (!('IntersectionObserver' in window)) {{
+                instantiateAllCharts();
+                return;
+            }}
+            const observer = new IntersectionObserver((entries) => {{
+                entries.forEach(entry => {{
+                    if (entry.isIntersecting) {{
+                        observer.unobserve(entry.target);
+                        instantiateChart(entry.target.id);
+                    }}
+                }});
+            }}, {{ rootMargin: '200px 0px' }}); // Start a little before the chart is visible
+            pendingCharts.forEach((_, canvasId) => observer.observe(document.getElementById(canvasId)));
+        }}
+
+        // The detailed table is filtered, sorted and paged in a Web Worker; the page only renders
+        // the rows whose indices the worker sends back
+        let tableWorker = null;
+        let latestTableRequestId = 0;
+        let currentTotalPages = 1;
+        let currentSort = null; // {{ column, direction }}
+
+        // Start the worker from the embedded source; run the same code on the main thread if workers are unavailable
+        function createTableWorker() {{
+            const source = document.getElementById('table-worker-source').textContent;
+            try {{
+                const url = URL.createObjectURL(new Blob([source], {{ type: 'text/javascript' }}));
+                return new Worker(url);
+            }} catch (error) {{
+                console.warn('Web Worker unavailable, filtering on the main thread:', error);
+                const workerScope = {{}};
+                const fallback = {{ onmessage: null }};
+                workerScope.postMessage = (data) => setTimeout(() => fallback.onmessage({{ data }}));
+                new Function('self', source)(workerScope);
+                fallback.postMessage = (data) => setTimeout(() => workerScope.onmessage({{ data }}));
+                return fallback;
+            }}
+        }}
+
+        // Start the worker and hand it the embedded detailed rows as JSON text (cheap to copy; the worker parses and codes them)
+        function initTableWorker() {{
+            if (!tableWorker) {{
+                tableWorker = createTableWorker();
+                tableWorker.onmessage = (event) => {{
+                    if (event.data.type === 'page' && event.data.requestId === latestTableRequestId) {{
+                        renderDetailedTableRows(event.data);
+                    }}
+                }};
+            }}
+            tableWorker.postMessage({{
+                type: 'load',
+                columns: DETAILED_TABLE_COLUMNS,
+                json: document.getElementById('detailed-table-data').textContent
             }});
+        }}
 
-            const totalPages = rowsPerPage === 'All' ? 1 : Math.ceil(filteredData.length / rowsPerPage);
-            document.getElementById('totalPagesSpan').textContent = totalPages;
-            document.getElementById('currentPageSpan').textContent = currentPage;
+        // Function to request the current page of the detailed table from the worker
+        function renderDetailedTable() {{
+            tableWorker.postMessage({{
+                type: 'query',
+                requestId: ++latestTableRequestId, // Results for older requests (e.g. while typing) are ignored
+                search: currentSearchTerm,
+                filters: {{ 'Nivel Eskola': currentNivelEskolaFilter, 'Munisipiu': currentMunisipiuFilter }},
+                sort: currentSort,
+                page: currentPage,
+                rowsPerPage: rowsPerPage
+            }});
+        }}
 
-            const startIndex = (currentPage - 1) * rowsPerPage;
-            const endIndex = rowsPerPage === 'All' ? filteredData.length : startIndex + rowsPerPage;
-            const paginatedData = filteredData.slice(startIndex, endIndex);
+        // Function to render the rows of one page returned by the worker
+        function renderDetailedTableRows(result) {{
+            currentPage = result.page;
+            currentTotalPages = result.totalPages;
+            document.getElementById('totalPagesSpan').textContent = result.totalPages;
+            document.getElementById('currentPageSpan').textContent = result.page;
 
             // Clear existing table content
             const detailedTableContainer = document.getElementById('detailed-table-container');
@@ -727,49 +1766,130 @@ html_content = f"""
             // Create table structure
             const table = document.createElement('table');
             table.className = "min-w-full divide-y divide-gray-200";
+            const sortMarker = (column) => currentSort && currentSort.column === column ? (currentSort.direction === 'asc' ? ' ▲' : ' ▼') : '';
             table.innerHTML = `
                 <thead>
                     <tr>
-                        <th scope="col" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider">Munisípiu</th>
-                        <th scope="col" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider">Seksu</th>
-                        <th scope="col" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider">Idade</th>
-                        <th scope="col" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider">Dixiplina</th>
-                        <th scope="col" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider">Nivel Eskola</th>
-                        <th scope="col" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider">Naran Eskola</th>
-                        <th scope="col" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider">Titulu/Tópiku</th>
-                        <th scope="col" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider">Timestamp</th>
+                        <th scope="col" data-sort-column="Munisipiu" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider cursor-pointer select-none">Munisípiu${{sortMarker('Munisipiu')}}</th>
+                        <th scope="col" data-sort-column="Seksu" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider cursor-pointer select-none">Seksu${{sortMarker('Seksu')}}</th>
+                        <th scope="col" data-sort-column="Idade" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider cursor-pointer select-none">Idade${{sortMarker('Idade')}}</th>
+                        <th scope="col" data-sort-column="Dixiplina" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider cursor-pointer select-none">Dixiplina${{sortMarker('Dixiplina')}}</th>
+                        <th scope="col" data-sort-column="Nivel Eskola" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider cursor-pointer select-none">Nivel Eskola${{sortMarker('Nivel Eskola')}}</th>
+                        <th scope="col" data-sort-column="Naran Eskola" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider cursor-pointer select-none">Naran Eskola${{sortMarker('Naran Eskola')}}</th>
+                        <th scope="col" data-sort-column="Titulu/Tópiku" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider cursor-pointer select-none">Titulu/Tópiku${{sortMarker('Titulu/Tópiku')}}</th>
+                        <th scope="col" data-sort-column="Timestamp" class="px-6 py-3 text-left text-xs font-medium text-blue-700 uppercase tracking-wider cursor-pointer select-none">Timestamp${{sortMarker('Timestamp')}}</th>
                     </tr>
                 </thead>
-                <tbody class="bg-white divide-y divide-gray-100" id="detailedTableBody">
-                </tbody>
             `;
-            detailedTableContainer.appendChild(table);
-            const detailedTableBody = document.getElementById('detailedTableBody');
+            const detailedTableBody = document.createElement('tbody');
+            detailedTableBody.className = "bg-white divide-y divide-gray-100";
+            detailedTableBody.id = 'detailedTableBody';
 
-
-            paginatedData.forEach(row => {{
+            result.rows.forEach(row => {{
                 const tr = document.createElement('tr');
-                tr.innerHTML = `
-                    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${{ row['Munisipiu'] }}</td>
-                    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${{ row['Seksu'] }}</td>
-                    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${{ row['Idade'] }}</td>
-                    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${{ row['Dixiplina'] }}</td>
-                    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${{ row['Nivel Eskola'] }}</td>
-                    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${{ row['Naran Eskola'] }}</td>
-                    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${{ row['Titulu/Tópiku'] }}</td>
-                    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${{ row['Timestamp'] }}</td>
-                `;
+                DETAILED_TABLE_COLUMNS.forEach(column => {{
+                    tr.appendChild(createCell(row[column], "px-6 py-4 whitespace-nowrap text-sm text-gray-900"));
+                }});
                 detailedTableBody.appendChild(tr);
             }});
+            table.appendChild(detailedTableBody);
+            detailedTableContainer.appendChild(table);
 
             // Update pagination button states
-            document.getElementById('prevPage').disabled = currentPage === 1;
-            document.getElementById('nextPage').disabled = currentPage === totalPages;
+            document.getElementById('prevPage').disabled = result.page === 1;
+            document.getElementById('nextPage').disabled = result.page === result.totalPages;
+        }}
+
+        // Run a callback when the browser is idle. The setTimeout fallback (Safari) gives each call an
+        // 8 ms budget measured from when it starts, so long renders still yield between chunks.
+        const scheduleIdle = window.requestIdleCallback
+            ? (callback) => window.requestIdleCallback(callback, {{ timeout: 500 }})
+            : (callback) => setTimeout(() => {{
+                const start = performance.now();
+                callback({{ timeRemaining: () => Math.max(0, 8 - (performance.now() - start)), didTimeout: false }});
+            }}, 1);
+
+        // Helper to build a table cell with text content
+        function createCell(text, className) {{
+            const td = document.createElement('td');
+            td.className = className;
+            td.textContent = text;
+            return td;
+        }}
+
+        // Function to render the School Municipality table: one collapsible group per municipality
+        // with its subtotal, then the school rows appended in small chunks while the browser is idle
+        let schoolTableRenderId = 0;
+        function renderSchoolMunicipalityTable() {{
+            const table = document.getElementById('schoolMunicipalityTable');
+            const {{ rows, groups }} = dashboardData.schoolMunicipalityTable;
+            const pendingGroups = [];
+            const renderId = ++schoolTableRenderId; // A newer render (after a data update) stops this one
+            table.querySelectorAll('tbody').forEach(tbody => tbody.remove());
+
+            groups.forEach(([municipality, start, end, subtotal]) => {{
+                const headerBody = document.createElement('tbody');
+                headerBody.className = "bg-blue-50";
+                const headerRow = document.createElement('tr');
+                headerRow.className = "cursor-pointer select-none hover:bg-gray-100";
+                headerRow.setAttribute('aria-expanded', 'true');
+                headerRow.appendChild(createCell(`▾ ${{municipality}}`, "px-4 py-2 whitespace-nowrap text-sm font-semibold text-gray-900"));
+                headerRow.appendChild(createCell(`${{end - start}} eskola`, "px-4 py-2 whitespace-nowrap text-sm text-gray-500"));
+                headerRow.appendChild(createCell(subtotal, "px-4 py-2 whitespace-nowrap text-sm font-semibold text-gray-900"));
+                headerBody.appendChild(headerRow);
+
+                const rowsBody = document.createElement('tbody');
+                rowsBody.className = "bg-white divide-y divide-gray-100";
+
+                headerRow.addEventListener('click', () => {{
+                    const expanded = rowsBody.hidden;
+                    rowsBody.hidden = !expanded;
+                    headerRow.setAttribute('aria-expanded', String(expanded));
+                    headerRow.firstChild.textContent = `${{expanded ? '▾' : '▸'}} ${{municipality}}`;
+                }});
+
+                table.appendChild(headerBody);
+                table.appendChild(rowsBody);
+                pendingGroups.push({{ rowsBody, next: start, end }});
+            }});
+
+            const CHUNK_SIZE = 50;
+            function renderChunk(deadline) {{
+                if (renderId !== schoolTableRenderId) {{
+                    return;
+                }}
+                while (pendingGroups.length > 0 && (deadline.timeRemaining() > 1 || deadline.didTimeout)) {{
+                    const group = pendingGroups[0];
+                    const fragment = document.createDocumentFragment();
+                    const chunkEnd = Math.min(group.next + CHUNK_SIZE, group.end);
+                    for (let i = group.next; i < chunkEnd; i++) {{
+                        const [school, total] = rows[i];
+                        const tr = document.createElement('tr');
+                        tr.appendChild(createCell('', "px-4 py-2 whitespace-nowrap text-sm font-medium text-gray-900"));
+                        tr.appendChild(createCell(school, "px-4 py-2 whitespace-nowrap text-sm text-gray-500"));
+                        tr.appendChild(createCell(total, "px-4 py-2 whitespace-nowrap text-sm text-gray-500"));
+                        fragment.appendChild(tr);
+                    }}
+                    group.rowsBody.appendChild(fragment);
+                    group.next = chunkEnd;
+                    if (group.next >= group.end) {{
+                        pendingGroups.shift();
+                    }}
+                    if (deadline.didTimeout) {{
+                        break; // Only one chunk when we were forced to run
+                    }}
+                }}
+                if (pendingGroups.length > 0) {{
+                    scheduleIdle(renderChunk);
+                }}
+            }}
+            scheduleIdle(renderChunk);
         }}
 
         // Function to populate filter options
         function populateFilterOptions() {{
             const nivelEskolaFilter = document.getElementById('nivelEskolaFilter');
+            nivelEskolaFilter.replaceChildren();
             dashboardData.allNivelEskolaOptions.forEach(option => {{
                 const opt = document.createElement('option');
                 opt.value = option;
@@ -778,39 +1898,96 @@ html_content = f"""
             }});
 
             const munisipiuFilter = document.getElementById('munisipiuFilter');
+            munisipiuFilter.replaceChildren();
             dashboardData.allMunisipiuOptions.forEach(option => {{
                 const opt = document.createElement('option');
                 opt.value = option;
                 opt.textContent = option;
                 munisipiuFilter.appendChild(opt);
             }});
+
+            // Keep the current selection when the options are rebuilt after a data update
+            nivelEskolaFilter.value = dashboardData.allNivelEskolaOptions.includes(currentNivelEskolaFilter) ? currentNivelEskolaFilter : 'All';
+            munisipiuFilter.value = dashboardData.allMunisipiuOptions.includes(currentMunisipiuFilter) ? currentMunisipiuFilter : 'All';
+            currentNivelEskolaFilter = nivelEskolaFilter.value;
+            currentMunisipiuFilter = munisipiuFilter.value;
         }}
 
-        // Initialize dashboard elements and charts
-        document.addEventListener('DOMContentLoaded', () => {{
+        // Function to fill in the summary cards
+        function renderTotals() {{
             document.getElementById('totalMunicipality').textContent = dashboardData.totalMunicipality;
             document.getElementById('totalGender').textContent = dashboardData.totalGender;
             document.getElementById('totalDiscipline').textContent = dashboardData.totalDiscipline;
             document.getElementById('totalTopiku').textContent = dashboardData.totalTopiku;
+        }}
 
-            // Create Charts
-            createPieChart('genderChart', 'Persentajen tuir Jéneru', dashboardData.genderChartData.labels, dashboardData.genderChartData.data);
-            createBarChart('ageChart', 'Distribuisaun tuir Idade', dashboardData.ageChartData.labels, dashboardData.ageChartData.data);
-            createBarChart('disciplineChart', 'Tópiku tuir kada Dixiplina', dashboardData.disciplineChartData.labels, dashboardData.disciplineChartData.data);
-            createBarChart('schoolLevelChart', 'Distribuisaun Tópiku tuir Nivel Eskola', dashboardData.schoolLevelChartData.labels, dashboardData.schoolLevelChartData.data);
-            createBarChart('municipalityChart', 'Distribuisaun Tópiku tuir Munisípiu', dashboardData.municipalityChartData.labels, dashboardData.municipalityChartData.data);
-
-            // Populate School Municipality Table
-            const schoolMunicipalityTableBody = document.getElementById('schoolMunicipalityTableBody');
-            dashboardData.schoolMunicipalityTableData.forEach(row => {{
-                const tr = document.createElement('tr');
-                tr.innerHTML = `
-                    <td class="px-4 py-2 whitespace-nowrap text-sm font-medium text-gray-900">${{ row['Munisipiu'] }}</td>
-                    <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-500">${{ row['Naran Eskola'] }}</td>
-                    <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-500">${{ row['Total'] }}</td>
-                `;
-                schoolMunicipalityTableBody.appendChild(tr);
+        // Re-render everything after dashboardData was updated in place
+        function refreshDashboard() {{
+            renderTotals();
+            chartInstances.forEach((chart, canvasId) => {{
+                chart.destroy();
+                chartInstances.set(canvasId, chartFactories[canvasId]());
             }});
+            renderSchoolMunicipalityTable();
+            populateFilterOptions();
+            renderDetailedTable(); // The worker already has the updated rows
+        }}
+
+        async function fetchJson(url, options) {{
+            const response = await fetch(url, options);
+            if (!response.ok) {{
+                throw new Error(`${{url}}: HTTP ${{response.status}}`);
+            }}
+            return response.json();
+        }}
+
+        // Bring a cached page up to date: follow the delta patches from our version to the latest one,
+        // or download the full snapshot when our version is too old to patch
+        async function checkForDataUpdates() {{
+            if (!dashboardData.version || !window.fetch) {{
+                return;
+            }}
+            try {{
+                const {{ version: latest, history }} = await fetchJson('./{DATA_VERSION_FILE.replace(os.sep, '/')}', {{ cache: 'no-store' }});
+                if (latest === dashboardData.version) {{
+                    return;
+                }}
+
+                // The detailed rows live in the table worker: it gets the new rows or each patch's row changes
+                let updated;
+                const start = history.lastIndexOf(dashboardData.version);
+                if (start === -1) {{
+                    const {{ detailedTableData, ...aggregates }} = await fetchJson('./{DATA_SNAPSHOT.replace(os.sep, '/')}', {{ cache: 'no-store' }});
+                    tableWorker.postMessage({{ type: 'rows', rows: detailedTableData }});
+                    updated = aggregates;
+                }} else {{
+                    const patches = [];
+                    for (let i = start; i < history.length - 1; i++) {{
+                        patches.push(await fetchJson(`./{DATA_PATCH_DIR.replace(os.sep, '/')}/${{history[i]}}-${{history[i + 1]}}.json`));
+                    }}
+                    // Only send them once all were downloaded, so a failed download leaves the table consistent
+                    patches.forEach(patch => tableWorker.postMessage({{ type: 'patch', upserts: patch.upserts, removed: patch.removed }}));
+                    updated = patches[patches.length - 1].aggregates;
+                }}
+                Object.assign(dashboardData, updated);
+                refreshDashboard();
+            }} catch (error) {{
+                console.warn('Could not check for dashboard data updates:', error);
+            }}
+        }}
+
+        // Initialize dashboard elements and charts
+        document.addEventListener('DOMContentLoaded', () => {{
+            // Register Chart.js Datalabels plugin globally (the deferred bundle has run by now)
+            Chart.register(ChartDataLabels);
+
+            renderTotals();
+
+            // Create Charts as they scroll into view
+            setupLazyCharts();
+
+            // Populate School Municipality Table (school rows are filled in during idle time)
+            renderSchoolMunicipalityTable();
 
             // Populate filter options
             populateFilterOptions();
@@ -852,28 +2029,76 @@ html_content = f"""
             }});
 
             document.getElementById('nextPage').addEventListener('click', () => {{
-                const totalPages = rowsPerPage === 'All' ? 1 : Math.ceil(dashboardData.detailedTableData.length / rowsPerPage);
-                if (currentPage < totalPages) {{
+                if (currentPage < currentTotalPages) {{
                     currentPage++;
                     renderDetailedTable();
                 }}
             }});
 
+            // Click a column header to sort by it; click again to reverse the order
+            document.getElementById('detailed-table-container').addEventListener('click', (event) => {{
+                const header = event.target.closest('th[data-sort-column]');
+                if (!header) {{
+                    return;
+                }}
+                const column = header.dataset.sortColumn;
+                const direction = currentSort && currentSort.column === column && currentSort.direction === 'asc' ? 'desc' : 'asc';
+                currentSort = {{ column, direction }};
+                currentPage = 1;
+                renderDetailedTable();
+            }});
+
             // Initial render of detailed table with default settings
+            initTableWorker();
             renderDetailedTable();
+
+            // Cache the page for instant repeat visits, then fetch only the data that changed since it was built
+            if ('serviceWorker' in navigator) {{
+                navigator.serviceWorker.register('./{SERVICE_WORKER}').catch(error => console.warn('Service worker registration failed:', error));
+            }}
+            checkForDataUpdates();
         }});
     </script>
 </body>
 </html>
 """
 
-# --- Step 4: Write the HTML content to the index.html file ---
-# This is the crucial part that was missing or incomplete.
-# Ensure this section is present and correct in your generate_dashboard.py file.
-try:
-    with open('index.html', 'w', encoding='utf-8') as f:
-        f.write(html_content)
-    print("index.html generated successfully with updated data.")
-except Exception as e:
-    print(f"Error writing index.html: {e}")
-
+    # --- Step 3b: Compile the purged Tailwind stylesheet for the classes used in html_content ---
+    tailwind_css_url = build_tailwind_css(html_content)
+    if tailwind_css_url:
+        tailwind_tag = f'<link rel="stylesheet" href="{tailwind_css_url}">'
+    else:
+        tailwind_tag = '<script src="https://cdn.tailwindcss.com"></script>'
+    html_content = html_content.replace('<!-- TAILWIND_STYLESHEET -->', tailwind_tag, 1)
+
+    # --- Step 3c: Write the service worker, now that every hashed asset of the page is known ---
+    if dashboard_data["version"]:
+        try:
+            write_output_file(SERVICE_WORKER, build_service_worker())
+        except Exception as e:
+            print(f"Error writing {SERVICE_WORKER}: {e}")
+
+    # --- Step 4: Write the HTML content to the index.html file ---
+    # Written atomically and skipped when byte-identical, so an unchanged build leaves the tree untouched
+    try:
+        if write_output_file(OUTPUT_HTML, html_content):
+            print(f"{OUTPUT_HTML} generated successfully with updated data.")
+        else:
+            print(f"{OUTPUT_HTML} unchanged, skipping write.")
+    except Exception as e:
+        print(f"Error writing {OUTPUT_HTML}: {e}")
+
+    # --- Step 5: Write the build manifest of all generated artifacts ---
+    try:
+        manifest = {"artifacts": dict(sorted(generated_artifacts.items()))}
+        if write_output_file(BUILD_MANIFEST, json.dumps(manifest, indent=2, ensure_ascii=False) + "\n", record=False):
+            print(f"{BUILD_MANIFEST} updated ({len(generated_artifacts)} artifacts).")
+    except Exception as e:
+        print(f"Error writing {BUILD_MANIFEST}: {e}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['--print-pins']:
+        print_pins()
+    else:
+        main()
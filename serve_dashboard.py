@@ -0,0 +1,271 @@
+import argparse # Import argparse for the command-line options
+import gzip # Import gzip for compressed responses
+import hashlib # Import hashlib for ETags
+import json
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from generate_dashboard import DETAILED_TABLE_COLUMNS, load_dashboard_data
+
+# Local JSON API over the same dashboard_data the generator embeds in index.html, so other
+# tools can query it instead of scraping the page. Run it against the live sheet
+# (GOOGLE_SHEET_API_KEY) or against a recorded Sheets API response:
+#
+#     python serve_dashboard.py --fixture fixtures/sheet_values.json
+#
+# Endpoints:
+#     /api/data                 full dashboard_data
+#     /api/totals               summary card totals
+#     /api/charts               names of the chart payloads
+#     /api/charts/<name>        one chart payload (gender, age, discipline, schoolLevel, municipality)
+#     /api/school-municipality  School x Municipality table with per-municipality subtotals
+#     /api/options              filter options
+#     /api/detail               filtered detail page: ?munisipiu=&nivel=&search=&sort=&order=asc|desc&page=&per_page=
+
+# --- Server settings ---
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+DETAIL_CACHE_SIZE = 256 # Maximum number of cached /api/detail filter combinations
+DEFAULT_PER_PAGE = 25
+MAX_PER_PAGE = 500
+GZIP_MIN_SIZE = 1024 # Smaller bodies are not worth compressing
+
+CHART_KEYS = {
+    'gender': 'genderChartData',
+    'age': 'ageChartData',
+    'discipline': 'disciplineChartData',
+    'schoolLevel': 'schoolLevelChartData',
+    'municipality': 'municipalityChartData',
+}
+TOTAL_KEYS = ['totalMunicipality', 'totalGender', 'totalDiscipline', 'totalTopiku']
+
+
+# A response body prepared once: JSON bytes, their ETag and (for larger bodies) the gzipped bytes.
+# The gzipped representation has its own ETag, as strong ETags must differ between content codings.
+class PreparedResponse:
+    def __init__(self, payload):
+        self.body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzipped = gzip.compress(self.body, mtime=0) if len(self.body) >= GZIP_MIN_SIZE else None
+        self.gzip_etag = f'"{digest}-gz"'
+
+
+# True if the Accept-Encoding header allows gzip (q-values respected, so "gzip;q=0" refuses it)
+def accepts_gzip(header):
+    qualities = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        match = re.search(r'q=([0-9.]+)', params)
+        try:
+            qualities[coding.strip().lower()] = float(match.group(1)) if match else 1.0
+        except ValueError:
+            qualities[coding.strip().lower()] = 0.0
+    return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0))) > 0
+
+
+# Sort key approximating the table worker's localeCompare(..., {numeric: true}): digit runs compare as
+# numbers ("9" before "17"), punctuation sorts before digits and digits before letters, and letters
+# compare case- and accent-insensitively (ties: lowercase first, as in ICU)
+def collation_key(value):
+    text = unicodedata.normalize('NFKD', str(value))
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    key = []
+    for token in re.findall(r'\d+|.', text, re.S):
+        if token.isdigit():
+            key.append((1, int(token), ''))
+        else:
+            key.append((2 if token.isalpha() else 0, 0, token))
+    return (tuple(key), str(value).swapcase())
+
+
+# Bounded least-recently-used cache for /api/detail responses, keyed by the normalized filter combination
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock() # The server handles requests on several threads
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+# In-memory aggregates: every fixed endpoint is serialized up front, detail pages on demand (cached)
+class DashboardApi:
+    def __init__(self, dashboard_data):
+        self.data = dashboard_data
+        self.rows = dashboard_data["detailedTableData"]
+        # Lower-cased searchable text per row, so a search does not re-lower every cell
+        self.search_text = ['\n'.join(str(row.get(column, '')) for column in DETAILED_TABLE_COLUMNS).lower() for row in self.rows]
+        self.detail_cache = LRUCache(DETAIL_CACHE_SIZE)
+
+        self.static = {
+            '/api/data': PreparedResponse(dashboard_data),
+            '/api/totals': PreparedResponse({key: dashboard_data.get(key, 0) for key in TOTAL_KEYS}),
+            '/api/charts': PreparedResponse(sorted(CHART_KEYS)),
+            '/api/school-municipality': PreparedResponse(dashboard_data["schoolMunicipalityTable"]),
+            '/api/options': PreparedResponse({
+                "nivelEskola": dashboard_data["allNivelEskolaOptions"],
+                "munisipiu": dashboard_data["allMunisipiuOptions"],
+            }),
+        }
+        for name, key in CHART_KEYS.items():
+            self.static[f'/api/charts/{name}'] = PreparedResponse(dashboard_data[key])
+
+    # Normalize the query string so equivalent requests share one cache entry
+    def detail_key(self, query):
+        def param(name, default=''):
+            return query.get(name, [default])[0].strip()
+
+        munisipiu = param('munisipiu', 'All') or 'All'
+        nivel = param('nivel', 'All') or 'All'
+        search = param('search').lower()
+        sort = param('sort')
+        if sort not in DETAILED_TABLE_COLUMNS:
+            sort = ''
+        order = 'desc' if param('order') == 'desc' else 'asc'
+        try:
+            page = max(1, int(param('page', '1')))
+            per_page = min(MAX_PER_PAGE, max(1, int(param('per_page', str(DEFAULT_PER_PAGE)))))
+        except ValueError:
+            raise ValueError("page and per_page must be integers")
+        return (munisipiu, nivel, search, sort, order, page, per_page)
+
+    def detail(self, query):
+        key = self.detail_key(query)
+        cached = self.detail_cache.get(key)
+        if cached is not None:
+            return cached
+
+        munisipiu, nivel, search, sort, order, page, per_page = key
+        matches = [
+            i for i, row in enumerate(self.rows)
+            if (munisipiu == 'All' or row.get('Munisipiu') == munisipiu)
+            and (nivel == 'All' or row.get('Nivel Eskola') == nivel)
+            and (not search or search in self.search_text[i])
+        ]
+        if sort:
+            matches.sort(key=lambda i: collation_key(self.rows[i].get(sort, '')), reverse=(order == 'desc'))
+
+        total_pages = max(1, -(-len(matches) // per_page))
+        page = min(page, total_pages) # Past the end: the last page, as in the page's table worker
+        start = (page - 1) * per_page
+        response = PreparedResponse({
+            "totalRows": len(matches),
+            "page": page,
+            "perPage": per_page,
+            "totalPages": total_pages,
+            "rows": [self.rows[i] for i in matches[start:start + per_page]],
+        })
+        self.detail_cache.put(key, response)
+        return response
+
+    def lookup(self, path, query):
+        path = path.rstrip('/') or '/'
+        if path == '/api/detail':
+            return self.detail(query)
+        return self.static.get(path)
+
+
+# Request handler: JSON with ETag/If-None-Match revalidation and gzip content negotiation
+class DashboardRequestHandler(BaseHTTPRequestHandler):
+    api = None # Set by run_server()
+    server_version = 'LMSMDashboard/1.0'
+
+    def do_GET(self):
+        self.respond(include_body=True)
+
+    def do_HEAD(self):
+        self.respond(include_body=False)
+
+    def respond(self, include_body):
+        url = urlparse(self.path)
+        try:
+            prepared = self.api.lookup(url.path, parse_qs(url.query))
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+            return
+        if prepared is None:
+            self.send_error_json(404, f"Unknown endpoint: {url.path}")
+            return
+
+        use_gzip = prepared.gzipped is not None and accepts_gzip(self.headers.get('Accept-Encoding', ''))
+        body, etag = (prepared.gzipped, prepared.gzip_etag) if use_gzip else (prepared.body, prepared.etag)
+
+        # If-None-Match may list several ETags; "*" matches anything
+        if_none_match = self.headers.get('If-None-Match', '')
+        if if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]:
+            self.send_response(304)
+            self.send_common_headers(etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_common_headers(etag)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def send_common_headers(self, etag):
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache') # Clients may cache, but must revalidate with the ETag
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Access-Control-Allow-Origin', '*')
+
+    def send_error_json(self, status, message):
+        body = json.dumps({"error": message}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+def run_server(dashboard_data, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    DashboardRequestHandler.api = DashboardApi(dashboard_data)
+    server = ThreadingHTTPServer((host, port), DashboardRequestHandler)
+    print(f"Serving dashboard API on http://{host}:{server.server_address[1]}/api/totals")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the LMSM dashboard aggregates as a local JSON API.")
+    parser.add_argument('--fixture', help="Recorded Sheets API response (JSON with a 'values' list) to use instead of the live sheet")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    values = None
+    if args.fixture:
+        with open(args.fixture, 'r', encoding='utf-8') as f:
+            values = json.load(f).get('values', [])
+    run_server(load_dashboard_data(values), args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()